@@ -0,0 +1,224 @@
+import argparse
+import csv
+import math
+import uuid
+from pathlib import Path
+
+import ifcopenshell
+import ifcopenshell.guid
+
+WALL_THICKNESS = 0.2
+SLAB_THICKNESS = 0.2
+COLUMN_SIZE = 0.4
+FURNITURE_SIZE = (0.8, 0.8, 0.75)
+
+
+# writes a synthetic IFC4 building with extruded walls, slabs and columns, curved elements (round columns and
+# round hollow walls) and furniture instances sharing one mapped representation. Everything is created with
+# plain entities in meters, so the files are the same with every IfcOpenShell version.
+class BuildingGenerator:
+    def __init__(self, storey_height=3.0):
+        self.storey_height = storey_height
+        self.model = ifcopenshell.file(schema="IFC4")
+        self.guids = 0
+        self.origin = self.axis((0.0, 0.0, 0.0))
+        self.up = self.model.createIfcDirection((0.0, 0.0, 1.0))
+
+        length_unit = self.model.createIfcSIUnit(None, "LENGTHUNIT", None, "METRE")
+        units = self.model.createIfcUnitAssignment([length_unit])
+        context = self.model.createIfcGeometricRepresentationContext(None, "Model", 3, 1e-5, self.origin, None)
+        self.body_context = self.model.createIfcGeometricRepresentationSubContext(
+            "Body", "Model", None, None, None, None, context, None, "MODEL_VIEW", None
+        )
+        self.project = self.model.createIfcProject(
+            self.guid(), None, "Benchmark", None, None, None, None, [context], units
+        )
+
+        self.site = self.spatial("IfcSite", "Site", None)
+        self.building = self.spatial("IfcBuilding", "Building", self.site.ObjectPlacement)
+        self.aggregate(self.project, [self.site])
+        self.aggregate(self.site, [self.building])
+        self.storeys = []
+
+        self.furniture_map = None
+        self.furniture_target = None
+
+    def point(self, coordinates):
+        return self.model.createIfcCartesianPoint(tuple(float(c) for c in coordinates))
+
+    # GlobalIds are counted, so generating a building twice gives the same file
+    def guid(self):
+        self.guids += 1
+        return ifcopenshell.guid.compress(uuid.UUID(int=self.guids).hex)
+
+    def axis(self, location, angle=0.0):
+        direction = self.model.createIfcDirection((math.cos(angle), math.sin(angle), 0.0))
+        return self.model.createIfcAxis2Placement3D(self.point(location), None, direction)
+
+    def placement(self, relative_to, location, angle=0.0):
+        return self.model.createIfcLocalPlacement(relative_to, self.axis(location, angle))
+
+    def spatial(self, ifc_class, name, relative_to, elevation=None):
+        location = (0.0, 0.0, elevation or 0.0)
+        placement = self.placement(relative_to, location)
+        entity = self.model.create_entity(ifc_class, GlobalId=self.guid(), Name=name, ObjectPlacement=placement)
+        if elevation is not None:
+            entity.Elevation = elevation
+        return entity
+
+    def aggregate(self, relating, related):
+        self.model.createIfcRelAggregates(self.guid(), None, None, None, relating, related)
+
+    def body(self, items, representation_type="SweptSolid"):
+        representation = self.model.createIfcShapeRepresentation(self.body_context, "Body", representation_type, items)
+        return self.model.createIfcProductDefinitionShape(None, None, [representation])
+
+    def extrusion(self, profile, depth, z=0.0):
+        return self.model.createIfcExtrudedAreaSolid(profile, self.axis((0.0, 0.0, z)), self.up, depth)
+
+    def rectangle(self, x_size, y_size, center=(0.0, 0.0)):
+        position = self.model.createIfcAxis2Placement2D(self.model.createIfcCartesianPoint(tuple(map(float, center))))
+        return self.model.createIfcRectangleProfileDef("AREA", None, position, x_size, y_size)
+
+    def circle(self, radius, thickness=None):
+        position = self.model.createIfcAxis2Placement2D(self.model.createIfcCartesianPoint((0.0, 0.0)))
+        if thickness is None:
+            return self.model.createIfcCircleProfileDef("AREA", None, position, radius)
+        return self.model.createIfcCircleHollowProfileDef("AREA", None, position, radius, thickness)
+
+    def product(self, ifc_class, name, storey, location, representation, angle=0.0):
+        return self.model.create_entity(
+            ifc_class,
+            GlobalId=self.guid(),
+            Name=name,
+            ObjectPlacement=self.placement(storey.ObjectPlacement, location, angle),
+            Representation=representation,
+        )
+
+    # the furniture's representation and mapping target are defined once and every instance maps them
+    def furniture(self, name, storey, location, angle):
+        if self.furniture_map is None:
+            x, y, z = FURNITURE_SIZE
+            representation = self.model.createIfcShapeRepresentation(
+                self.body_context, "Body", "SweptSolid", [self.extrusion(self.rectangle(x, y), z)]
+            )
+            self.furniture_map = self.model.createIfcRepresentationMap(self.origin, representation)
+            self.furniture_target = self.model.createIfcCartesianTransformationOperator3D(
+                None, None, self.point((0, 0, 0)), None, None
+            )
+        item = self.model.createIfcMappedItem(self.furniture_map, self.furniture_target)
+        return self.product("IfcFurniture", name, storey, location, self.body([item], "MappedRepresentation"), angle)
+
+    def add_storey(self, walls, slabs, columns, curved=0, mapped=0):
+        i = len(self.storeys)
+        elevation = i * self.storey_height
+        storey = self.spatial("IfcBuildingStorey", f"Storey {i}", self.building.ObjectPlacement, elevation)
+        self.aggregate(self.building, [storey])
+        self.storeys.append(storey)
+
+        side = get_side(walls, slabs, columns)
+        height = self.storey_height - SLAB_THICKNESS
+        products = []
+
+        # slabs tile the floor, their tops are at the storey's elevation
+        tiles = max(1, math.ceil(math.sqrt(slabs)))
+        tile = side / tiles
+        for k in range(slabs):
+            x, y = (k % tiles + 0.5) * tile, (k // tiles + 0.5) * tile
+            solid = self.extrusion(self.rectangle(tile, tile), SLAB_THICKNESS, z=-SLAB_THICKNESS)
+            products.append(self.product("IfcSlab", f"Slab {i}.{k}", storey, (x, y, 0), self.body([solid])))
+
+        # walls run along X and Y alternately
+        for k in range(walls):
+            offset = (k // 2 + 1) * side / (walls // 2 + 2)
+            angle = 0.0 if k % 2 == 0 else math.pi / 2
+            location = (side / 2, offset, 0) if k % 2 == 0 else (offset, side / 2, 0)
+            solid = self.extrusion(self.rectangle(side, WALL_THICKNESS), height)
+            products.append(self.product("IfcWall", f"Wall {i}.{k}", storey, location, self.body([solid]), angle))
+
+        grid = max(1, math.ceil(math.sqrt(columns + curved)))
+        spacing = side / grid
+        points = [((k % grid + 0.5) * spacing, (k // grid + 0.5) * spacing, 0) for k in range(columns + curved)]
+        for k in range(columns):
+            solid = self.extrusion(self.rectangle(COLUMN_SIZE, COLUMN_SIZE), height)
+            products.append(self.product("IfcColumn", f"Column {i}.{k}", storey, points[k], self.body([solid])))
+
+        # curved elements alternate between round columns and round hollow walls
+        for k in range(curved):
+            if k % 2 == 0:
+                ifc_class, profile = "IfcColumn", self.circle(COLUMN_SIZE / 2)
+            else:
+                ifc_class, profile = "IfcWall", self.circle(min(2.0, spacing / 3), WALL_THICKNESS)
+            solid = self.extrusion(profile, height)
+            products.append(self.product(ifc_class, f"Round {i}.{k}", storey, points[columns + k], self.body([solid])))
+
+        furniture_grid = max(1, math.ceil(math.sqrt(mapped)))
+        furniture_spacing = side / furniture_grid
+        for k in range(mapped):
+            x, y = k % furniture_grid + 0.3, k // furniture_grid + 0.7
+            location = (x * furniture_spacing, y * furniture_spacing, 0)
+            angle = (k % 4) * math.pi / 2
+            products.append(self.furniture(f"Chair {i}.{k}", storey, location, angle))
+
+        self.model.createIfcRelContainedInSpatialStructure(self.guid(), None, None, None, products, storey)
+        return storey
+
+    # slab tops in millimeters in the format mark_floors and detect_levels write, the top of the roof included
+    def get_levels(self):
+        return [(f"floor_{i}", round(i * self.storey_height * 1000)) for i in range(len(self.storeys) + 1)]
+
+
+# the footprint grows with the number of elements so that elements don't pile up
+def get_side(walls, slabs, columns):
+    return max(10.0, 4.0 * math.sqrt(walls + slabs + columns))
+
+
+def generate(path, storeys=3, walls=20, slabs=4, columns=20, curved=0, mapped=0, storey_height=3.0):
+    generator = BuildingGenerator(storey_height=storey_height)
+    for _ in range(storeys):
+        generator.add_storey(walls, slabs, columns, curved=curved, mapped=mapped)
+    # the roof
+    side = get_side(walls, slabs, columns)
+    roof = generator.spatial("IfcBuildingStorey", "Roof", generator.building.ObjectPlacement, storeys * storey_height)
+    generator.aggregate(generator.building, [roof])
+    solid = generator.extrusion(generator.rectangle(side, side), SLAB_THICKNESS, z=-SLAB_THICKNESS)
+    slab = generator.product("IfcSlab", "Roof", roof, (side / 2, side / 2, 0), generator.body([solid]))
+    generator.model.createIfcRelContainedInSpatialStructure(generator.guid(), None, None, None, [slab], roof)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # a fixed time stamp keeps the content hash of the file, and so the shape cache, the same between runs
+    generator.model.header.file_name.time_stamp = "2000-01-01T00:00:00"
+    generator.model.write(str(path))
+    level_path = path.parent / f"{path.stem}.csv"
+    with level_path.open("w", newline="") as f:
+        csv.writer(f).writerows(generator.get_levels())
+    return path, level_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generates a synthetic IFC building and its level file")
+    parser.add_argument("path", help="IFC file to write, the level file is written next to it")
+    parser.add_argument("--storeys", type=int, default=3, help="number of storeys")
+    parser.add_argument("--walls", type=int, default=20, help="number of walls per storey")
+    parser.add_argument("--slabs", type=int, default=4, help="number of slabs per storey")
+    parser.add_argument("--columns", type=int, default=20, help="number of columns per storey")
+    parser.add_argument("--curved", type=int, default=0, help="number of round columns and walls per storey")
+    parser.add_argument("--mapped", type=int, default=0, help="number of furniture instances per storey")
+    parser.add_argument("--storey-height", type=float, default=3.0, help="storey height in meters")
+    args = parser.parse_args()
+    path, level_path = generate(
+        args.path,
+        storeys=args.storeys,
+        walls=args.walls,
+        slabs=args.slabs,
+        columns=args.columns,
+        curved=args.curved,
+        mapped=args.mapped,
+        storey_height=args.storey_height,
+    )
+    print(f"Saved {path} and {level_path}")
+
+
+if __name__ == "__main__":
+    main()
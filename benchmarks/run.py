@@ -0,0 +1,153 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import ifcopenshell
+
+from batchplan.extract_floor_plans import create_context, get_parser, process_file
+from batchplan.instrumentation import recorder
+
+sys.path.insert(0, str(Path(__file__).parent))
+from generate_ifc import generate  # noqa: E402
+
+# element counts per storey of every scenario, all scenarios are generated with fixed sizes so runs are comparable
+SCENARIOS = {
+    "small": {"storeys": 3, "walls": 20, "slabs": 4, "columns": 20},
+    "large": {"storeys": 10, "walls": 200, "slabs": 16, "columns": 200},
+    "curved": {"storeys": 3, "walls": 20, "slabs": 4, "columns": 20, "curved": 40},
+    "mapped": {"storeys": 3, "walls": 20, "slabs": 4, "columns": 20, "mapped": 200},
+}
+
+
+def get_versions():
+    versions = {"python": platform.python_version(), "ifcopenshell": ifcopenshell.version}
+    try:
+        from OCC import VERSION
+
+        versions["pythonocc"] = VERSION
+    except ImportError:
+        pass
+    try:
+        cwd = Path(__file__).parent
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=cwd, capture_output=True, text=True, check=True)
+        versions["commit"] = commit.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return versions
+
+
+# min and median of the repeats, the min is the least noisy estimate of a stage's cost
+def summarize(reports):
+    stages = {}
+    for name in reports[0]["stages"]:
+        walls = [report["stages"][name]["wall"] for report in reports if name in report["stages"]]
+        stages[name] = {
+            "calls": reports[0]["stages"][name]["calls"],
+            "min": round(min(walls), 6),
+            "median": round(statistics.median(walls), 6),
+        }
+    return {
+        "stages": stages,
+        "counters": reports[0]["counters"],
+        "peak_rss_mb": max(report["peak_rss_mb"] for report in reports),
+    }
+
+
+def run_case(ifc_path, engine, args, extra_args):
+    output = Path(args.work_dir) / "output" / engine
+    extract_args = ["--no-display", "--output", str(output), "--section-engine", engine]
+    for formatter in args.formatters:
+        extract_args.extend(["--formatter", formatter])
+    extract_args = get_parser().parse_args([str(ifc_path), *extract_args, *extra_args])
+    context = create_context(extract_args)
+    reports = []
+    for _ in range(args.repeat):
+        process_file(context, ifc_path)
+        reports.append(recorder.get_report())
+    return summarize(reports)
+
+
+# stages slower than threshold times the baseline are regressions, stages faster than min_seconds are ignored
+def compare(results, baseline, threshold, min_seconds):
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        for name, stats in result["stages"].items():
+            base = baseline[case]["stages"].get(name)
+            if base is None or max(stats["min"], base["min"]) < min_seconds:
+                continue
+            ratio = stats["min"] / max(base["min"], 1e-9)
+            if ratio > threshold:
+                regressions.append((case, name, base["min"], stats["min"], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="generates synthetic IFC files, runs extract_floor_plans on them without a display and writes "
+        "timings of every stage as JSON, unknown arguments are passed to extract_floor_plans"
+    )
+    parser.add_argument(
+        "--scenario", action="append", choices=list(SCENARIOS), help="scenarios to run, all of them by default"
+    )
+    parser.add_argument(
+        "--engine", action="append", choices=["brep", "batch", "mesh"], help="section engines, brep by default"
+    )
+    parser.add_argument(
+        "--formatter",
+        dest="formatters",
+        action="append",
+        default=[],
+        help="formatters to run, FloorRasterFormatter by default",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of every scenario and engine")
+    parser.add_argument("--work-dir", default="benchmark_data", help="directory of generated files and outputs")
+    parser.add_argument("--output", default="benchmark.json", help="result file")
+    parser.add_argument("--compare", help="baseline result file, exits with an error if a stage got slower")
+    parser.add_argument("--threshold", type=float, default=1.25, help="max allowed ratio of a stage's time to baseline")
+    parser.add_argument(
+        "--min-seconds", type=float, default=0.05, help="stages faster than this in both runs aren't compared"
+    )
+    args, extra_args = parser.parse_known_args()
+    scenarios = args.scenario or list(SCENARIOS)
+    engines = args.engine or ["brep"]
+
+    results = {}
+    for scenario in scenarios:
+        ifc_path = Path(args.work_dir) / f"{scenario}.ifc"
+        start = time.perf_counter()
+        generate(ifc_path, **SCENARIOS[scenario])
+        print(f"Generated {ifc_path} in {time.perf_counter() - start:.2f} s")
+        for engine in engines:
+            case = f"{scenario}/{engine}"
+            results[case] = run_case(ifc_path, engine, args, extra_args)
+            print(f"{case}: {results[case]['stages']['file']['min']:.3f} s")
+
+    result = {
+        "versions": get_versions(),
+        "scenarios": {name: SCENARIOS[name] for name in scenarios},
+        "repeat": args.repeat,
+        "arguments": extra_args,
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(result, indent=2))
+    print(f"Saved {args.output}")
+
+    if args.compare is not None:
+        baseline = json.loads(Path(args.compare).read_text())["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        for case, name, before, after, ratio in regressions:
+            print(f"Regression in {case} {name}: {before:.3f} s -> {after:.3f} s ({ratio:.2f}x)")
+        if len(regressions) > 0:
+            sys.exit(1)
+        print(f"No regressions compared to {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
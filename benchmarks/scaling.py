@@ -0,0 +1,64 @@
+import argparse
+import json
+from pathlib import Path
+
+from generate_ifc import generate
+from run import SCENARIOS, get_versions, run_case
+
+
+# time of sectioning and making faces, threads do both in one native call which is timed as section
+def get_section_time(result):
+    stages = result["stages"]
+    return sum(stages[name]["min"] for name in ("section", "make_faces") if name in stages)
+
+
+# sections the same generated model serially and with different numbers of section threads, every thread count
+# runs through the thread pool, so 1 thread shows the pool's overhead. Speedups are relative to the serial path.
+def main():
+    parser = argparse.ArgumentParser(
+        description="measures how sectioning scales with --section-threads, unknown arguments are passed to "
+        "extract_floor_plans"
+    )
+    parser.add_argument("--scenario", default="large", choices=list(SCENARIOS), help="generated model")
+    parser.add_argument(
+        "--threads", type=int, nargs="+", default=[1, 2, 4, 8], help="numbers of section threads to measure"
+    )
+    parser.add_argument(
+        "--formatter",
+        dest="formatters",
+        action="append",
+        default=[],
+        help="formatters to run, FloorWKTFormatter by default",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of every thread count")
+    parser.add_argument("--work-dir", default="benchmark_data", help="directory of generated files and outputs")
+    parser.add_argument("--output", default="scaling.json", help="result file")
+    args, extra_args = parser.parse_known_args()
+    args.formatters = args.formatters or ["FloorWKTFormatter"]
+
+    ifc_path = Path(args.work_dir) / f"{args.scenario}.ifc"
+    generate(ifc_path, **SCENARIOS[args.scenario])
+
+    results = {"serial": run_case(ifc_path, "brep", args, extra_args)}
+    for threads in args.threads:
+        results[threads] = run_case(ifc_path, "brep", args, [*extra_args, "--section-threads", str(threads)])
+
+    base = get_section_time(results["serial"])
+    print(f"{'threads':>8} {'section':>10} {'file':>10} {'speedup':>8}")
+    for threads, result in results.items():
+        section = get_section_time(result)
+        print(f"{threads:>8} {section:>10.3f} {result['stages']['file']['min']:>10.3f} {base / section:>8.2f}")
+
+    result = {
+        "versions": get_versions(),
+        "scenario": SCENARIOS[args.scenario],
+        "repeat": args.repeat,
+        "arguments": extra_args,
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(result, indent=2))
+    print(f"Saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
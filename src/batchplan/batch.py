@@ -0,0 +1,143 @@
+import argparse
+import glob
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from .memory import to_megabytes
+
+MANIFEST_COLUMNS = ["ifc", "status", "return_code", "duration", "elements", "peak_rss_mb", "log"]
+
+
+def get_element_count(log_path):
+    matches = re.findall(r"Total # elements: (\d+)", log_path.read_text(errors="replace"))
+    if len(matches) == 0:
+        return None
+    return int(matches[-1])
+
+
+def run_file(ifc_path, extract_args, output, timeout=None, max_memory=None):
+    output_dir = Path(output) / ifc_path.stem
+    output_dir.mkdir(parents=True, exist_ok=True)
+    log_path = output_dir / "extract.log"
+
+    cmd = [
+        sys.executable,
+        "-m",
+        "batchplan.extract_floor_plans",
+        glob.escape(str(ifc_path)),
+        "--output",
+        str(output),
+        *extract_args,
+    ]
+    # the child limits itself before loading the file, preexec_fn isn't safe in threads and limiting the started
+    # process from here races with it
+    if max_memory is not None:
+        cmd += ["--max-memory", str(max_memory)]
+    timed_out = threading.Event()
+    # the timer may fire while the child is being reaped, the lock makes sure a reaped child is never killed
+    lock = threading.Lock()
+    reaped = False
+    start = time.perf_counter()
+    with log_path.open("w") as log:
+        # each file gets its own session so that a timeout also kills the pool workers it started
+        p = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+        def kill():
+            with lock:
+                if reaped:
+                    return
+                # an exited child stays a zombie until it's reaped, so its process group can't be recycled yet
+                if os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None:
+                    return
+                try:
+                    os.killpg(p.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    return
+                timed_out.set()
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+        # waits without reaping, the child is reaped under the lock so that the timer never sees a reaped pid
+        os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOWAIT)
+        with lock:
+            # os.wait4 is used instead of Popen.wait to get the resource usage of this child only
+            _, status, rusage = os.wait4(p.pid, 0)
+            reaped = True
+        p.returncode = os.waitstatus_to_exitcode(status)
+        if timer is not None:
+            timer.cancel()
+    duration = time.perf_counter() - start
+
+    if timed_out.is_set():
+        status = "timeout"
+    elif p.returncode == 0:
+        status = "ok"
+    elif p.returncode < 0:
+        status = f"killed ({signal.Signals(-p.returncode).name})"
+    else:
+        status = "failed"
+
+    return {
+        "ifc": str(ifc_path),
+        "status": status,
+        "return_code": p.returncode,
+        "duration": round(duration, 3),
+        "elements": get_element_count(log_path),
+        "peak_rss_mb": round(to_megabytes(rusage.ru_maxrss), 1),
+        "log": str(log_path),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="runs extract_floor_plans for every IFC file in a separate process, "
+        "unknown arguments are passed to extract_floor_plans"
+    )
+    parser.add_argument("ifc_paths")
+    parser.add_argument("--output", default="output", help="output directory")
+    parser.add_argument("--jobs", type=int, default=1, help="number of files processed at the same time")
+    parser.add_argument("--timeout", type=float, help="time limit per file in seconds")
+    parser.add_argument("--max-memory", type=float, help="memory limit per file in megabytes")
+    parser.add_argument("--manifest", default="manifest.csv", help="summary file name in the output directory")
+    args, extract_args = parser.parse_known_args()
+
+    ifc_paths = sorted(Path(p) for p in glob.glob(args.ifc_paths))
+    if len(ifc_paths) == 0:
+        print("No IFC file found!")
+        return
+
+    output = Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    manifest_path = output / args.manifest
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            executor.submit(run_file, ifc_path, extract_args, output, args.timeout, args.max_memory): ifc_path
+            for ifc_path in ifc_paths
+        }
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            print(f"[{len(rows)}/{len(ifc_paths)}] {row['status']}: {row['ifc']} ({row['duration']}s)")
+            # the manifest is rewritten after every file so that it is useful even if the batch is interrupted
+            df = pd.DataFrame(rows, columns=MANIFEST_COLUMNS).sort_values("ifc")
+            df.to_csv(manifest_path, index=False)
+
+    failed = [row for row in rows if row["status"] != "ok"]
+    print(f"Done: {len(rows) - len(failed)} succeeded, {len(failed)} failed. Manifest: {manifest_path}")
+
+
+if __name__ == "__main__":
+    main()
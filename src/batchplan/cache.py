@@ -0,0 +1,165 @@
+import fcntl
+import hashlib
+import json
+import os
+from collections import namedtuple
+from pathlib import Path
+
+import ifcopenshell
+from OCC.Core.BinTools import bintools
+from OCC.Core.TopoDS import TopoDS_Shape
+from OCC.Extend.TopologyUtils import TopologyExplorer
+
+from .utils import GEOMETRY_SETTINGS, make_compound
+
+# mimics the shape tuples returned by ifcopenshell.geom.create_shape
+CachedShape = namedtuple("CachedShape", ("data", "geometry", "styles"))
+
+
+def get_file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_settings_key():
+    return json.dumps({"ifcopenshell": ifcopenshell.version, "settings": GEOMETRY_SETTINGS}, sort_keys=True)
+
+
+# writes to a temporary file first so that concurrent runs sharing the cache never see partial files
+def write_atomic(path, write_fn):
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    write_fn(tmp_path)
+    os.replace(tmp_path, path)
+
+
+# on-disk cache of element shapes stored as binary BRep, shapes of a model are kept in a directory keyed by
+# the hash of the file content and the geometry settings, least recently used entries are evicted first. The
+# total size is kept in a file at the root, so the cache is only scanned once it's full.
+class ShapeCache:
+    def __init__(self, root, ifc_path, max_size=None, section_key="brep"):
+        self.root = Path(root)
+        self.max_size = max_size
+        key = hashlib.sha256(f"{get_file_hash(ifc_path)}:{get_settings_key()}".encode()).hexdigest()
+        self.dir = self.root / key
+        self.shape_dir = self.dir / "shapes"
+        # sections found by different engines are kept apart
+        self.section_dir = self.dir / "sections" / section_key
+        self.shape_dir.mkdir(parents=True, exist_ok=True)
+        self.section_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.section_hits = 0
+        self.section_misses = 0
+        # bytes written by this run, added to the total when evicting
+        self.added = 0
+
+    # GlobalIds are case sensitive, they are hex encoded to be safe on case insensitive file systems
+    def get_name(self, element):
+        return f"{element.GlobalId}_{element.id()}".encode().hex()
+
+    def get_path(self, element, suffix):
+        return self.shape_dir / f"{self.get_name(element)}{suffix}"
+
+    # section heights are rounded to micrometers
+    def get_section_path(self, element, section_height):
+        return self.section_dir / self.get_name(element) / f"{section_height:.6f}.brep"
+
+    # returns (found, shape), shape is None if creating the shape with the given method failed before. Failures
+    # are kept per method since the geometry iterator skips elements that create_shape doesn't fail on.
+    def get(self, element, method):
+        fail_path = self.get_path(element, f".{method}.fail")
+        if fail_path.exists():
+            self.hits += 1
+            os.utime(fail_path)
+            return True, None
+
+        brep_path = self.get_path(element, ".brep")
+        styles_path = self.get_path(element, ".json")
+        if not brep_path.exists() or not styles_path.exists():
+            self.misses += 1
+            return False, None
+
+        geometry = TopoDS_Shape()
+        if not bintools.Read(geometry, str(brep_path)):
+            self.misses += 1
+            return False, None
+        styles = [tuple(style) for style in json.loads(styles_path.read_text())]
+        os.utime(brep_path)
+        os.utime(styles_path)
+        self.hits += 1
+        return True, CachedShape(None, geometry, styles)
+
+    def put(self, element, shape):
+        styles = [list(style) for style in shape.styles]
+        styles_path = self.get_path(element, ".json")
+        brep_path = self.get_path(element, ".brep")
+        write_atomic(styles_path, lambda p: p.write_text(json.dumps(styles)))
+        write_atomic(brep_path, lambda p: bintools.Write(shape.geometry, str(p)))
+        self.added += styles_path.stat().st_size + brep_path.stat().st_size
+
+    def put_failure(self, element, method):
+        write_atomic(self.get_path(element, f".{method}.fail"), lambda p: p.touch())
+
+    def has_section(self, element, section_height):
+        found = self.get_section_path(element, section_height).exists()
+        if found:
+            self.section_hits += 1
+        else:
+            self.section_misses += 1
+        return found
+
+    def get_section(self, element, section_height):
+        path = self.get_section_path(element, section_height)
+        compound = TopoDS_Shape()
+        bintools.Read(compound, str(path))
+        os.utime(path)
+        return list(TopologyExplorer(compound).faces())
+
+    # faces are stored as a compound, elements without sections are stored as empty compounds
+    def put_section(self, element, section_height, faces):
+        path = self.get_section_path(element, section_height)
+        path.parent.mkdir(exist_ok=True)
+        compound = make_compound(faces)
+        write_atomic(path, lambda p: bintools.Write(compound, str(p)))
+        self.added += path.stat().st_size
+
+    # the files of a shape are evicted together, every section is an entry of its own. Temporary files of
+    # concurrent runs aren't entries.
+    def get_entries(self):
+        entries = {}
+        for path in self.root.glob("*/*/**/*"):
+            if not path.is_file() or path.suffix == ".tmp":
+                continue
+            key = path
+            if path.parent.name == "shapes":
+                key = path.with_name(path.name.split(".", 1)[0])
+            stat = path.stat()
+            mtime, size, paths = entries.get(key, (0, 0, []))
+            entries[key] = (max(mtime, stat.st_mtime), size + stat.st_size, paths + [path])
+        return list(entries.values())
+
+    # evicts down to fill times the max size, so that a full cache isn't scanned again after every run
+    def evict(self, fill=0.9):
+        if self.max_size is None:
+            return
+        size_path = self.root / "size"
+        with (self.root / "lock").open("w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if size_path.exists():
+                total = int(size_path.read_text()) + self.added
+            else:
+                total = sum(size for _, size, _ in self.get_entries())
+            self.added = 0
+            if total > self.max_size:
+                entries = self.get_entries()
+                total = sum(size for _, size, _ in entries)
+                for _, size, paths in sorted(entries, key=lambda entry: entry[0]):
+                    if total <= self.max_size * fill:
+                        break
+                    for path in paths:
+                        path.unlink(missing_ok=True)
+                    total -= size
+            write_atomic(size_path, lambda p: p.write_text(str(total)))
@@ -0,0 +1,141 @@
+import argparse
+import csv
+import glob
+import multiprocessing
+from functools import partial
+from pathlib import Path
+
+import ifcopenshell
+import numpy as np
+from OCC.Core.BRepGProp import brepgprop
+from OCC.Core.GProp import GProp_GProps
+
+from .cache import ShapeCache
+from .utils import get_bounding_box, get_elements_and_shapes
+
+
+# returns top elevations of slabs and their footprint areas. The footprint is found as volume / thickness, so
+# sloped slabs like ramps and pitched roofs get small weights, the bounding box is used for slabs without volume.
+def get_slab_tops(shapes):
+    tops = []
+    areas = []
+    for shape in shapes:
+        xmin, ymin, zmin, xmax, ymax, zmax = get_bounding_box([shape.geometry])
+        props = GProp_GProps()
+        brepgprop.VolumeProperties(shape.geometry, props)
+        thickness = zmax - zmin
+        area = abs(props.Mass()) / thickness if thickness > 1e-6 else 0.0
+        if area <= 0:
+            area = (xmax - xmin) * (ymax - ymin)
+        tops.append(zmax)
+        areas.append(area)
+    return np.array(tops, dtype=float), np.array(areas, dtype=float)
+
+
+# clusters slab tops weighted by area. Sorted tops closer than tolerance form a cluster whose elevation is the
+# area weighted median of its tops, clusters with less than min_area_ratio of the largest cluster's area are
+# dropped, and of clusters closer than min_height the one with the larger area is kept.
+def cluster_levels(tops, areas, tolerance=0.5, min_height=2.0, min_area_ratio=0.1):
+    if len(tops) == 0:
+        return []
+    order = np.argsort(tops, kind="stable")
+    tops, areas = tops[order], areas[order]
+    starts = np.flatnonzero(np.diff(tops, prepend=-np.inf) > tolerance)
+    ends = np.append(starts[1:], len(tops))
+
+    elevations = []
+    weights = []
+    for start, end in zip(starts, ends):
+        cluster_tops, cluster_areas = tops[start:end], areas[start:end]
+        cumulative = np.cumsum(cluster_areas)
+        median = np.searchsorted(cumulative, cumulative[-1] / 2)
+        elevations.append(cluster_tops[min(median, len(cluster_tops) - 1)])
+        weights.append(cumulative[-1])
+    elevations = np.array(elevations)
+    weights = np.array(weights)
+
+    keep = weights >= min_area_ratio * weights.max()
+    elevations, weights = elevations[keep], weights[keep]
+    levels = []
+    for i in np.argsort(-weights, kind="stable"):
+        if all(abs(elevations[i] - level) >= min_height for level in levels):
+            levels.append(elevations[i])
+    return sorted(levels)
+
+
+def detect_file(ifc_path, args):
+    model = ifcopenshell.open(ifc_path)
+    cache = ShapeCache(args.cache_dir, ifc_path) if args.cache_dir is not None else None
+    _, shapes = get_elements_and_shapes(
+        model.by_type("IfcSlab"),
+        filter_fn=lambda el: el.Representation is not None,
+        geom_threads=args.geom_threads,
+        cache=cache,
+    )
+    tops, areas = get_slab_tops(shapes)
+    levels = cluster_levels(
+        tops, areas, tolerance=args.tolerance, min_height=args.min_height, min_area_ratio=args.min_area_ratio
+    )
+    # the same format mark_floors writes: a name and the top of the floor's slab in millimeters
+    rows = [(f"floor_{i}", int(round(z * 1000))) for i, z in enumerate(levels)]
+    out_file = ifc_path.parent / f"{ifc_path.stem}.csv"
+    with out_file.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerows(rows)
+    return f"{len(rows)} levels from {len(shapes)} slabs, saved {out_file}"
+
+
+# a failing file is reported instead of stopping the whole batch
+def try_detect_file(ifc_path, args):
+    try:
+        return ifc_path, detect_file(ifc_path, args)
+    except Exception as e:
+        return ifc_path, f"failed: {e}"
+
+
+def print_results(results):
+    for ifc_path, message in results:
+        print(f"{ifc_path}: {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="detects floor levels from slab elevations and writes them next to IFC files in the format "
+        "extract_floor_plans reads"
+    )
+    parser.add_argument("ifc_paths")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="max distance in meters of tops in a level")
+    parser.add_argument("--min-height", type=float, default=2.0, help="min distance in meters between levels")
+    parser.add_argument(
+        "--min-area-ratio",
+        type=float,
+        default=0.1,
+        help="levels with less slab area than this ratio of the largest level's slab area are dropped",
+    )
+    parser.add_argument("--overwrite", action="store_true", help="overwrite existing level files")
+    parser.add_argument("--geom-threads", type=int, default=1, help="number of threads used to create shapes")
+    parser.add_argument("--cache-dir", help="directory to cache shapes between runs")
+    parser.add_argument("--jobs", type=int, default=1, help="number of files processed at the same time")
+    args = parser.parse_args()
+
+    ifc_paths = sorted(Path(p) for p in glob.glob(args.ifc_paths))
+    if len(ifc_paths) == 0:
+        print("No IFC file found!")
+        return
+    if not args.overwrite:
+        existing = [p for p in ifc_paths if (p.parent / f"{p.stem}.csv").exists()]
+        if len(existing) > 0:
+            print(f"Skipping {len(existing)} files with level files, use --overwrite to detect their levels")
+        ifc_paths = [p for p in ifc_paths if p not in existing]
+
+    detect = partial(try_detect_file, args=args)
+    if args.jobs > 1:
+        mp_context = multiprocessing.get_context("spawn")
+        with mp_context.Pool(args.jobs) as pool:
+            print_results(pool.imap_unordered(detect, ifc_paths))
+    else:
+        print_results(map(detect, ifc_paths))
+
+
+if __name__ == "__main__":
+    main()
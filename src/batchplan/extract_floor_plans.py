@@ -1,26 +1,55 @@
 import argparse
+import gc
 import glob
+import inspect
+import math
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from importlib import import_module
 from pathlib import Path
 
 import ifcopenshell
 import ifcopenshell.geom
+import numpy as np
 import OCC.Core.BRepAlgoAPI
+import OCC.Core.BRepBuilderAPI
 import pandas as pd
 from ifcopenshell.util.element import get_decomposition
+from OCC.Core.BRepAdaptor import BRepAdaptor_Surface
 from OCC.Core.BRepAlgoAPI import BRepAlgoAPI_Section
 from OCC.Core.BRepBuilderAPI import BRepBuilderAPI_MakeFace
 from OCC.Core.TopTools import TopTools_HSequenceOfShape
-from OCC.Display.SimpleGui import init_display
+from OCC.Core.TopoDS import topods
 from OCC.Extend.TopologyUtils import TopologyExplorer
 from tqdm import tqdm
 
 from . import filters, fixes, formatters, stylings
-from .formatters import draw_shapes
+from .cache import ShapeCache, get_file_hash
+from .formatters import StyleResolver, clear_display, create_display, draw_shapes
+from .instrumentation import count, profile, recorder, stage, time_element
+from .journal import (
+    FORMATTER_ARGS,
+    MODEL_LEVEL,
+    RunJournal,
+    get_args_key,
+    get_level_fingerprint,
+    get_model_fingerprint,
+)
+from .memory import get_peak_rss, get_rss, limit_memory
+from .slicing import iter_mesh_level_faces
 from .utils import (
+    Discretizer,
+    ZIntervalIndex,
+    dump_shapes,
     get_bounding_box,
+    get_elements,
     get_elements_and_shapes,
     get_geometries,
+    get_location,
+    get_z_extents,
+    iter_compound,
+    load_shapes,
+    make_compound,
 )
 
 
@@ -29,38 +58,396 @@ def get_section_surface(section_height, xmin, ymin, xmax, ymax):
     return OCC.Core.BRepBuilderAPI.BRepBuilderAPI_MakeFace(section_plane, xmin - 1, xmax + 1, ymin - 1, ymax + 1).Face()
 
 
-def get_section_faces(section_surface, shape):
-    section = BRepAlgoAPI_Section(section_surface, shape.geometry).Shape()
+def get_section_faces(section_surface, shape, run_parallel=False):
+    return get_geometry_section_faces(section_surface, shape.geometry, run_parallel=run_parallel)
+
+
+def get_geometry_section_faces(section_surface, geometry, run_parallel=False):
+    with stage("section"):
+        section = BRepAlgoAPI_Section(section_surface, geometry, False)
+        section.SetRunParallel(run_parallel)
+        section.Build()
+    return get_sections_faces([section.Shape()])[0]
+
+
+# connects section edges to wires and wires to faces with holes natively in one call for all sections, returns
+# the faces of every section. Falls back to making a face of every wire in Python, without holes, if the fixes
+# module is built without SectionsToFaces or it fails.
+def get_sections_faces(sections):
+    if not hasattr(fixes, "SectionsToFaces"):
+        return [get_section_edges_faces(section) for section in sections]
+    section_shapes = TopTools_HSequenceOfShape()
+    for section in sections:
+        section_shapes.Append(section)
+    try:
+        with stage("make_faces"):
+            compounds = fixes.SectionsToFaces(section_shapes, 1e-5, True)
+    except RuntimeError as e:
+        count("make_faces_fallbacks")
+        print(f"Faces with holes could not be made, exception={e}")
+        return [get_section_edges_faces(section) for section in sections]
+    sections_faces = []
+    for j in range(len(sections)):
+        faces = [topods.Face(face) for face in iter_compound(compounds.Value(j + 1))]
+        count("section_faces", len(faces))
+        sections_faces.append(faces)
+    return sections_faces
+
+
+def get_section_edges_faces(section):
     section_edges = list(TopologyExplorer(section).edges())
-
     if len(section_edges) == 0:
         return []
 
-    edge_shapes = TopTools_HSequenceOfShape()
-    for edge in section_edges:
-        edge_shapes.Append(edge)
-    wire_shapes = fixes.ConnectEdgesToWiresFixed(edge_shapes, 1e-5, True)
+    count("section_edges", len(section_edges))
+    with stage("connect_edges"):
+        edge_shapes = TopTools_HSequenceOfShape()
+        for edge in section_edges:
+            edge_shapes.Append(edge)
+        wire_shapes = fixes.ConnectEdgesToWiresFixed(edge_shapes, 1e-5, True)
+
+    with stage("make_faces"):
+        faces = []
+        for j in range(len(wire_shapes)):
+            wire_shape = wire_shapes.Value(j + 1)
+            face = BRepBuilderAPI_MakeFace(wire_shape).Face()
+            faces.append(face)
+    count("section_faces", len(faces))
+    return faces
+
+
+# sections all geometries of a level in one native call, every geometry is sectioned against the plane on its
+# own. A single boolean taking all geometries as arguments intersected the elements with each other as well.
+def get_batch_section_faces(section_surface, geometries, run_parallel=False, elements=None, report=None):
+    if len(geometries) == 0:
+        return []
+    if not hasattr(fixes, "SectionShapesToFaces"):
+        return [get_geometry_section_faces(section_surface, geometry, run_parallel) for geometry in geometries]
+    section_height = BRepAdaptor_Surface(section_surface).Plane().Location().Z()
+    with stage("batch_section"):
+        compounds = section_chunk(section_height, geometries, run_parallel)
+    return [
+        get_chunk_faces(compounds, k, None if elements is None else elements[k], report) for k in range(len(geometries))
+    ]
+
+
+def section_geometries(section_surface, geometries, engine="brep", run_parallel=False, elements=None, report=None):
+    if engine == "batch":
+        return get_batch_section_faces(
+            section_surface, geometries, run_parallel=run_parallel, elements=elements, report=report
+        )
+    return [get_geometry_section_faces(section_surface, geometry, run_parallel=run_parallel) for geometry in geometries]
+
+
+# returns (element index, faces) pairs of the given elements, elements are timed one by one if they are given
+def get_level_faces(section_surface, shapes, indices, engine="brep", run_parallel=False, elements=None):
+    if engine == "brep" and elements is not None:
+        level_faces = []
+        for i in indices:
+            try:
+                with time_element("section", elements[i]):
+                    faces = get_geometry_section_faces(section_surface, shapes[i].geometry, run_parallel=run_parallel)
+            except RuntimeError as e:
+                report_section_failure(elements[i], e)
+                faces = []
+            level_faces.append((i, faces))
+        return level_faces
+    geometries = [shapes[i].geometry for i in indices]
+    level_elements = None if elements is None else [elements[i] for i in indices]
+    return list(zip(indices, section_geometries(section_surface, geometries, engine, run_parallel, level_elements)))
+
+
+# elements whose section failed are reported like elements whose shape couldn't be created and get no faces
+def report_section_failure(element, exception):
+    count("section_failures")
+    if element is None:
+        print(f"Section could not be found, exception={exception}")
+    else:
+        print(f"Section could not be found for: type={element.is_a()}, name={element.Name}, exception={exception}")
+
+
+# returns the key of an instance's section, instances only rotated around Z and cut at the same height in the
+# prototype's coordinates have the same section up to their placements
+def get_instance_section_key(shape, section_height):
+    instance = getattr(shape, "instance", None)
+    if instance is None:
+        return None
+    key, matrix = instance
+    if not np.allclose(matrix[2, :3], (0, 0, 1)) or not np.allclose(matrix[:2, 2], 0):
+        return None
+    return key, round(section_height - matrix[2, 3], 6)
+
+
+# splits elements to be sectioned into the ones which are computed and the instances whose sections are moved
+# copies of an earlier instance's section, donors maps section keys to the instances computing them
+def plan_instance_sections(shapes, section_height, indices, donors):
+    computed = []
+    reused = []
+    for i in indices:
+        key = get_instance_section_key(shapes[i], section_height)
+        if key is None:
+            computed.append(i)
+        elif key in donors:
+            reused.append((i, key))
+        else:
+            donors[key] = i
+            computed.append(i)
+    return computed, reused
+
+
+def move_instance_faces(faces, shape, donor_shape):
+    location = get_location(shape.instance[1] @ np.linalg.inv(donor_shape.instance[1]))
+    return [face.Moved(location) for face in faces]
+
+
+# yields (element index, faces) pairs level by level for the elements whose Z extents contain the section
+# heights, sections found in earlier runs are taken from the shape cache and only the rest are computed
+def iter_level_faces(context, section_heights, elements, shapes, bbox, z_index):
+    cache = context.get("shape_cache")
+    levels = []
+    donors = {}
+    for section_height in section_heights:
+        candidates = z_index.query(section_height)
+        missing = candidates
+        if cache is not None:
+            missing = [i for i in candidates if not cache.has_section(elements[i], section_height)]
+        missing, reused = plan_instance_sections(shapes, section_height, missing, donors)
+        levels.append((section_height, candidates, missing, reused))
+        count("sections_computed", len(missing))
+        count("sections_reused", len(reused))
+        count("sections_cached", len(candidates) - len(missing) - len(reused))
+    # sections of donors are kept until the last level reusing them
+    last_uses = {key: j for j, (*_, reused) in enumerate(levels) for _, key in reused}
+    donor_faces = {}
+
+    engine = context.get("section_engine", "brep")
+    run_parallel = context.get("parallel_section", False)
+    workers = context.get("workers", 1)
+    section_threads = context.get("section_threads")
+    if engine == "mesh":
+        computed = iter_mesh_level_faces(
+            [(h, m) for h, _, m, _ in levels],
+            list(get_geometries(shapes)),
+            deflection=context.get("mesh_deflection", 0.01),
+        )
+    elif workers > 1:
+        computed = iter_level_faces_in_pool(
+            [(h, m) for h, _, m, _ in levels],
+            shapes,
+            bbox,
+            workers,
+            engine=engine,
+            run_parallel=run_parallel,
+            elements=elements,
+        )
+    elif section_threads is not None and engine == "brep":
+        computed = iter_level_faces_in_threads(
+            [(h, m) for h, _, m, _ in levels], shapes, section_threads, run_parallel=run_parallel, elements=elements
+        )
+    else:
+        computed = (
+            get_level_faces(
+                get_section_surface(h, bbox[0], bbox[1], bbox[3], bbox[4]), shapes, m, engine, run_parallel, elements
+            )
+            for h, _, m, _ in levels
+        )
 
-    faces = []
-    for j in range(len(wire_shapes)):
-        wire_shape = wire_shapes.Value(j + 1)
-        face = BRepBuilderAPI_MakeFace(wire_shape).Face()
-        faces.append(face)
+    for j, ((section_height, candidates, missing, reused), level_faces) in enumerate(zip(levels, computed)):
+        if cache is None and len(last_uses) == 0:
+            yield level_faces
+            continue
+        level_faces = dict(level_faces)
+        for i in missing:
+            key = get_instance_section_key(shapes[i], section_height)
+            if key in last_uses:
+                donor_faces[key] = (i, level_faces[i])
+        for i, key in reused:
+            donor, faces = donor_faces[key]
+            level_faces[i] = move_instance_faces(faces, shapes[i], shapes[donor])
+        for key in set(key for _, key in reused):
+            if last_uses[key] == j:
+                del donor_faces[key]
+        if cache is None:
+            yield [(i, level_faces[i]) for i in candidates]
+            continue
+        for i in missing:
+            cache.put_section(elements[i], section_height, level_faces[i])
+        for i, _ in reused:
+            cache.put_section(elements[i], section_height, level_faces[i])
+        for i in candidates:
+            if i not in level_faces:
+                level_faces[i] = cache.get_section(elements[i], section_height)
+        yield [(i, level_faces[i]) for i in candidates]
+
+
+def collect_level_sections(name, level_faces, elements, shapes):
+    tqdm.write(f"{name}: sectioned {len(level_faces)}, skipped {len(elements) - len(level_faces)} elements")
+
+    section_elements = []
+    section_shapes = []
+    section_faces = []
+    for i, faces in level_faces:
+        if len(faces) > 0:
+            section_elements.append(elements[i])
+            section_shapes.append(shapes[i])
+            section_faces.append(faces)
+    return section_elements, section_shapes, section_faces
+
+
+worker_geometries = None
+
+
+def init_section_worker(geometries):
+    global worker_geometries
+    worker_geometries = load_shapes(geometries)
+
+
+# failures are sent back as (element index, message) pairs to be reported by the parent, failing elements get no
+# faces like in the serial path
+def section_worker(task):
+    section_height, bbox, indices, engine, run_parallel = task
+    section_surface = get_section_surface(section_height, bbox[0], bbox[1], bbox[3], bbox[4])
+    geometries = [worker_geometries[i] for i in indices]
+    failures = []
+
+    def report(i, exception):
+        failures.append((i, str(exception)))
+
+    try:
+        element_faces = section_geometries(section_surface, geometries, engine, run_parallel, indices, report)
+    except RuntimeError:
+        # the chunk is sectioned again element by element, so that only the failing elements lose their faces
+        failures.clear()
+        element_faces = []
+        for i, geometry in zip(indices, geometries):
+            try:
+                element_faces.extend(section_geometries(section_surface, [geometry], engine, run_parallel, [i], report))
+            except RuntimeError as e:
+                report(i, e)
+                element_faces.append([])
+    return indices, dump_shapes([make_compound(faces) for faces in element_faces]), failures
+
+
+# sections levels in a process pool, geometries are sent to the workers once and faces are sent back as
+# serialized BRep. Takes (section height, element indices) pairs and yields the same (element index, faces)
+# pairs as get_level_faces, level by level in order.
+def iter_level_faces_in_pool(levels, shapes, bbox, workers, engine="brep", run_parallel=False, elements=None):
+    tasks = []
+    task_counts = []
+    for section_height, indices in levels:
+        chunk_size = max(1, math.ceil(len(indices) / (workers * 4)))
+        chunks = [indices[j : j + chunk_size] for j in range(0, len(indices), chunk_size)]
+        tasks.extend((section_height, bbox, chunk, engine, run_parallel) for chunk in chunks)
+        task_counts.append(len(chunks))
+
+    if len(tasks) == 0:
+        for _ in levels:
+            yield []
+        return
+
+    geometries = dump_shapes(list(get_geometries(shapes)))
+    mp_context = multiprocessing.get_context("spawn")
+    with mp_context.Pool(workers, initializer=init_section_worker, initargs=(geometries,)) as pool:
+        results = pool.imap(section_worker, tasks)
+        for task_count in task_counts:
+            level_faces = []
+            for _ in range(task_count):
+                indices, element_faces, failures = next(results)
+                for i, exception in failures:
+                    report_section_failure(None if elements is None else elements[i], exception)
+                for i, faces in zip(indices, load_shapes(element_faces)):
+                    level_faces.append((i, list(TopologyExplorer(faces).faces())))
+            yield level_faces
+
+
+def section_chunk(section_height, geometries, run_parallel):
+    geometry_shapes = TopTools_HSequenceOfShape()
+    for geometry in geometries:
+        geometry_shapes.Append(geometry)
+    return fixes.SectionShapesToFaces(geometry_shapes, section_height, 1e-5, True, run_parallel)
+
+
+# faces of the k-th geometry of a chunk, SectionShapesToFaces returns a null shape if its section failed
+def get_chunk_faces(compounds, k, element=None, report=None):
+    compound = compounds.Value(k + 1)
+    if compound.IsNull():
+        (report or report_section_failure)(element, "sectioning or making faces failed")
+        return []
+    faces = [topods.Face(face) for face in iter_compound(compound)]
+    count("section_faces", len(faces))
     return faces
 
 
+# sections levels in a thread pool sharing the shapes in memory. The native call sections and makes faces with
+# the GIL released and doesn't modify the shapes, so threads run in parallel without copying geometries. Yields
+# the same (element index, faces) pairs as get_level_faces, level by level in order.
+def iter_level_faces_in_threads(levels, shapes, threads, run_parallel=False, elements=None):
+    with ThreadPoolExecutor(threads) as executor:
+        for section_height, indices in levels:
+            chunk_size = max(1, math.ceil(len(indices) / (threads * 4)))
+            chunks = [indices[j : j + chunk_size] for j in range(0, len(indices), chunk_size)]
+            with stage("section"):
+                futures = [
+                    executor.submit(section_chunk, section_height, [shapes[i].geometry for i in chunk], run_parallel)
+                    for chunk in chunks
+                ]
+                level_faces = []
+                for chunk, future in zip(chunks, futures):
+                    compounds = future.result()
+                    for k, i in enumerate(chunk):
+                        element = None if elements is None else elements[i]
+                        level_faces.append((i, get_chunk_faces(compounds, k, element)))
+            yield level_faces
+
+
+def draw_overview(context, elements, shapes):
+    display = context["display"]
+    if display is None:
+        return
+    print("Drawing shapes for 3D...")
+    clear_display(display)
+    with stage("draw_overview"):
+        draw_shapes(display, elements, shapes, styles=context["styles"])
+    print("Done")
+
+
+def draw_section_surface(context, section_height, section_shapes):
+    display = context["display"]
+    if display is None:
+        return
+    # now we can calculate a more strict bbox
+    bbox = get_bounding_box(get_geometries(section_shapes))
+    section_surface = get_section_surface(section_height, bbox[0], bbox[1], bbox[3], bbox[4])
+    display.DisplayShape(section_surface, transparency=0.7)
+
+
+def export_overview(context):
+    display = context["display"]
+    if display is None:
+        return
+    with stage("export_overview"):
+        display.View_Iso()
+        display.FitAll()
+        display.Repaint()
+        path_to_export = str(context["output_dir"] / "3D.png")
+        display.ExportToImage(path_to_export)
+
+
 def process_using_storeys(context):
-    model = ifcopenshell.open(context["ifc_path"])
+    with stage("open_ifc"):
+        model = ifcopenshell.open(context["ifc_path"])
     print("Loading and filtering elements and shapes...")
-    elements, shapes = get_elements_and_shapes(model, filter_fn=context.get("filter_fn"))
+    elements, shapes = get_elements_and_shapes(
+        model,
+        filter_fn=context.get("filter_fn"),
+        geom_threads=context.get("geom_threads", 1),
+        cache=context.get("shape_cache"),
+        instancing=context.get("instancing", False),
+    )
     print("Done")
     print("Total # elements:", len(elements))
 
-    display = context["display"]
-    print("Drawing shapes for 3D...")
-    display.EraseAll()
-    draw_shapes(display, elements, shapes, color_fn=context["color_fn"], skip_colorless=context["args"].skip_colorless)
-    print("Done")
+    draw_overview(context, elements, shapes)
 
     global_bbox = get_bounding_box(get_geometries(shapes))
 
@@ -71,90 +458,210 @@ def process_using_storeys(context):
         # find the middle of two storeys in meters
         section_height = (s0.Elevation + s1.Elevation) / 2000
         print(f"Storey: {name}")
+        if len(get_pending_formatters(context, name, section_height)) == 0:
+            print(f"Skipping {name}, its outputs are up to date")
+            continue
 
-        section_surface = get_section_surface(
-            section_height, global_bbox[0], global_bbox[1], global_bbox[3], global_bbox[4]
-        )
         section_elements = get_decomposition(s0)
-        elements, shapes = get_elements_and_shapes(section_elements, filter_fn=context.get("filter_fn"))
-        section_elements = []
-        section_shapes = []
-        section_faces = []
-        for element, shape in zip(elements, shapes):
-            faces = get_section_faces(section_surface, shape)
-            if len(faces) > 0:
-                section_elements.append(element)
-                section_shapes.append(shape)
-                section_faces.append(faces)
+        elements, shapes = get_elements_and_shapes(
+            section_elements,
+            filter_fn=context.get("filter_fn"),
+            geom_threads=context.get("geom_threads", 1),
+            cache=context.get("shape_cache"),
+            instancing=context.get("instancing", False),
+        )
+        z_index = ZIntervalIndex(get_z_extents(shapes))
+        level_faces = next(iter_level_faces(context, [section_height], elements, shapes, global_bbox, z_index))
+        section_elements, section_shapes, section_faces = collect_level_sections(name, level_faces, elements, shapes)
 
+        level_items.append((name, section_height, section_elements, section_shapes, section_faces))
         if len(section_shapes) > 0:
-            level_items.append((name, section_elements, section_shapes, section_faces))
-
-            # now we can calculate a more strict bbox
-            bbox = get_bounding_box(get_geometries(section_shapes))
-            section_surface = get_section_surface(section_height, bbox[0], bbox[1], bbox[3], bbox[4])
-            display.DisplayShape(section_surface, transparency=0.7)
+            draw_section_surface(context, section_height, section_shapes)
 
-    display.View_Iso()
-    display.FitAll()
-    path_to_export = str(context["output_dir"] / "3D.png")
-    display.ExportToImage(path_to_export)
+    export_overview(context)
 
-    for name, se, ss, sf in tqdm(level_items, desc="Running formatters", total=len(level_items)):
-        for formatter in context["formatters"]:
-            formatter.process(name, se, ss, sf)
+    for name, section_height, se, ss, sf in tqdm(level_items, desc="Running formatters", total=len(level_items)):
+        run_formatters(context, name, section_height, se, ss, sf)
 
 
 def process(context):
-    model = ifcopenshell.open(context["ifc_path"])
+    with stage("open_ifc"):
+        model = ifcopenshell.open(context["ifc_path"])
     print("Loading elements and shapes...")
-    elements, shapes = get_elements_and_shapes(model, filter_fn=context.get("filter_fn"), filter=context.get("filter"))
+    elements, shapes = get_elements_and_shapes(
+        model,
+        filter_fn=context.get("filter_fn"),
+        filter=context.get("filter"),
+        geom_threads=context.get("geom_threads", 1),
+        cache=context.get("shape_cache"),
+        instancing=context.get("instancing", False),
+    )
     print("Done")
     print("Total # elements:", len(elements))
 
-    display = context["display"]
-    print("Drawing shapes for 3D...")
-    display.EraseAll()
-    draw_shapes(display, elements, shapes, color_fn=context["color_fn"], skip_colorless=context["args"].skip_colorless)
-    print("Done")
+    draw_overview(context, elements, shapes)
 
     global_bbox = get_bounding_box(get_geometries(shapes))
+    z_index = ZIntervalIndex(get_z_extents(shapes))
 
     levels = context["levels"]
+    section_heights = [section_height for _, section_height in levels]
+    all_level_faces = iter_level_faces(context, section_heights, elements, shapes, global_bbox, z_index)
+
     level_items = []
-    for name, section_height in tqdm(levels, desc="Finding sections", total=len(levels)):
-        section_surface = get_section_surface(
-            section_height, global_bbox[0], global_bbox[1], global_bbox[3], global_bbox[4]
-        )
-        section_elements = []
-        section_shapes = []
-        section_faces = []
-        for element, shape in zip(elements, shapes):
-            faces = get_section_faces(section_surface, shape)
-            if len(faces) > 0:
-                section_elements.append(element)
-                section_shapes.append(shape)
-                section_faces.append(faces)
+    for (name, section_height), level_faces in tqdm(
+        zip(levels, all_level_faces), desc="Finding sections", total=len(levels)
+    ):
+        section_elements, section_shapes, section_faces = collect_level_sections(name, level_faces, elements, shapes)
 
+        level_items.append((name, section_height, section_elements, section_shapes, section_faces))
         if len(section_shapes) > 0:
-            level_items.append((name, section_elements, section_shapes, section_faces))
+            draw_section_surface(context, section_height, section_shapes)
 
-            # now we can calculate a more strict bbox
-            bbox = get_bounding_box(get_geometries(section_shapes))
-            section_surface = get_section_surface(section_height, bbox[0], bbox[1], bbox[3], bbox[4])
-            display.DisplayShape(section_surface, transparency=0.7)
+    export_overview(context)
 
-    display.View_Iso()
-    display.FitAll()
-    path_to_export = str(context["output_dir"] / "3D.png")
-    display.ExportToImage(path_to_export)
+    for name, section_height, se, ss, sf in tqdm(level_items, desc="Running formatters", total=len(level_items)):
+        run_formatters(context, name, section_height, se, ss, sf)
 
-    for name, se, ss, sf in tqdm(level_items, desc="Running formatters", total=len(level_items)):
-        for formatter in context["formatters"]:
-            formatter.process(name, se, ss, sf)
 
+# returns the formatters which haven't finished the level yet, all of them unless resuming
+def get_pending_formatters(context, name, section_height):
+    if not context["args"].resume:
+        return context["formatters"]
+    return [formatter for formatter in context["formatters"] if not is_done(context, formatter, name, section_height)]
 
-def main():
+
+# per model outputs can't be resumed partially, they are done only if the whole model is recorded as done
+def is_done(context, formatter, name, section_height):
+    formatter_name = type(formatter).__name__
+    if formatter.per_model:
+        name = MODEL_LEVEL
+        fingerprint = context["model_fingerprints"][formatter_name]
+    else:
+        fingerprint = get_level_fingerprint(context["file_hash"], context["args_keys"][formatter_name], section_height)
+    return context["journal"].is_done(context["journal_key"], name, formatter_name, fingerprint)
+
+
+# levels without sections are recorded as well, so that they aren't sectioned again when resuming. Cached
+# polylines are dropped after every level since they are keyed by the level's edges
+def run_formatters(context, name, section_height, elements, shapes, faces):
+    for formatter in get_pending_formatters(context, name, section_height):
+        formatter_name = type(formatter).__name__
+        if len(shapes) > 0:
+            with stage(f"format:{formatter_name}"):
+                formatter.process(name, elements, shapes, faces)
+        if not formatter.per_model:
+            args_key = context["args_keys"][formatter_name]
+            fingerprint = get_level_fingerprint(context["file_hash"], args_key, section_height)
+            context["journal"].record(
+                context["journal_key"], name, formatter_name, fingerprint, get_outputs(formatter, name)
+            )
+    context["discretizer"].edges.clear()
+
+
+def finish_formatters(context):
+    for formatter in context["formatters"]:
+        formatter_name = type(formatter).__name__
+        with stage(f"format:{formatter_name}"):
+            formatter.finish()
+        if formatter.per_model:
+            context["journal"].record(
+                context["journal_key"],
+                MODEL_LEVEL,
+                formatter_name,
+                context["model_fingerprints"][formatter_name],
+                get_outputs(formatter, MODEL_LEVEL),
+            )
+
+
+# outputs a formatter has written for a level, levels without sections may have none
+def get_outputs(formatter, name):
+    path = formatter.get_output_path(name)
+    if path is None or not path.exists():
+        return []
+    return [path]
+
+
+# levels are None when they are inferred from the IFC file itself
+def get_model_fingerprints(context, levels=None):
+    return {
+        name: get_model_fingerprint(context["file_hash"], args_key, levels)
+        for name, args_key in context["args_keys"].items()
+    }
+
+
+# sections found with different engines or mesh deflections are cached separately, sections cached before holes
+# were nested in faces are not used
+def get_section_key(args):
+    if args.section_engine == "mesh":
+        return f"mesh_holes_{args.mesh_deflection}"
+    if args.section_engine == "batch":
+        return "batch_plane"
+    # the fallback of an older fixes module doesn't make holes
+    if not hasattr(fixes, "SectionsToFaces"):
+        return args.section_engine
+    return f"{args.section_engine}_holes"
+
+
+# sections, formats and releases one level at a time. Only elements and their Z extents are kept for the whole
+# model, shapes of a level are loaded when the level is processed (from the shape cache if it's enabled) and
+# released afterwards. The 3D overview is skipped since it would keep every shape in the display.
+def process_streaming(context, chunk_size=1000):
+    with stage("open_ifc"):
+        model = ifcopenshell.open(context["ifc_path"])
+    print("Finding Z extents of elements...")
+    elements = get_elements(model, filter_fn=context.get("filter_fn"), filter=context.get("filter"))
+    loaded_elements = []
+    extents = []
+    bboxes = []
+    for j in tqdm(range(0, len(elements), chunk_size), desc="Loading chunks"):
+        chunk_elements, chunk_shapes = load_shapes_of(context, elements[j : j + chunk_size])
+        if len(chunk_shapes) > 0:
+            loaded_elements.extend(chunk_elements)
+            extents.extend(get_z_extents(chunk_shapes))
+            bboxes.append(get_bounding_box(get_geometries(chunk_shapes)))
+        del chunk_shapes
+    elements = loaded_elements
+    if len(elements) == 0:
+        print("No element found!")
+        return
+    bboxes = np.array(bboxes).reshape(-1, 6)
+    global_bbox = (*bboxes[:, :3].min(axis=0), *bboxes[:, 3:].max(axis=0))
+    z_index = ZIntervalIndex(extents)
+    print("Done")
+    print("Total # elements:", len(elements))
+    print(f"Peak RSS: {get_peak_rss():.1f} MB")
+
+    for name, section_height in tqdm(context["levels"], desc="Processing levels", total=len(context["levels"])):
+        candidates = z_index.query(section_height)
+        level_elements, level_shapes = load_shapes_of(context, [elements[i] for i in candidates])
+        level_z_index = ZIntervalIndex(get_z_extents(level_shapes))
+        level_faces = next(
+            iter_level_faces(context, [section_height], level_elements, level_shapes, global_bbox, level_z_index)
+        )
+        section_elements, section_shapes, section_faces = collect_level_sections(
+            name, level_faces, level_elements, level_shapes
+        )
+        run_formatters(context, name, section_height, section_elements, section_shapes, section_faces)
+        del level_shapes, level_faces, section_shapes, section_faces
+        tqdm.write(f"{name}: peak RSS {get_peak_rss():.1f} MB")
+
+
+def load_shapes_of(context, elements):
+    return get_elements_and_shapes(
+        elements,
+        geom_threads=context.get("geom_threads", 1),
+        cache=context.get("shape_cache"),
+        instancing=context.get("instancing", False),
+    )
+
+
+def takes_argument(fn, name):
+    parameters = inspect.signature(fn).parameters.values()
+    return any(p.name == name or p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters)
+
+
+def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("ifc_paths")
     parser.add_argument("--output", default="output", help="output directory")
@@ -168,6 +675,7 @@ def main():
     parser.add_argument(
         "--color-fn", default="all_black", help="color function to determine elements' colors in floor plan"
     )
+    parser.add_argument("--color-mapping", help="mapping file passed to the color function (e.g. for carbon_color)")
     parser.add_argument(
         "--skip-colorless",
         action="store_true",
@@ -175,8 +683,84 @@ def main():
     )
     parser.add_argument("--width", default=2048, help="floor plan width")
     parser.add_argument("--height", default=2048, help="floor plan height")
-    args = parser.parse_args()
+    parser.add_argument(
+        "--geom-threads",
+        type=int,
+        default=1,
+        help="number of threads used by IfcOpenShell's geometry iterator to create shapes",
+    )
+    parser.add_argument("--offscreen", action="store_true", help="render images without opening a window")
+    parser.add_argument(
+        "--no-display",
+        action="store_true",
+        help="don't create a display, 3D.png is skipped and only formatters without a display can be used",
+    )
+    parser.add_argument("--cache-dir", help="directory to cache shapes between runs")
+    parser.add_argument(
+        "--cache-size", type=float, default=10240, help="cache size limit in megabytes, least recently used go first"
+    )
+    parser.add_argument(
+        "--section-engine",
+        choices=["brep", "batch", "mesh"],
+        default="brep",
+        help="brep sections every element separately, batch sections all elements of a level in one native call, "
+        "mesh slices triangulated elements which is faster but approximate",
+    )
+    parser.add_argument(
+        "--mesh-deflection", type=float, default=0.01, help="linear deflection of the mesh section engine in meters"
+    )
+    parser.add_argument(
+        "--parallel-section", action="store_true", help="run OpenCASCADE's boolean operations in parallel mode"
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="process levels one by one and release their shapes to bound memory usage, "
+        "use with --cache-dir to avoid creating shapes twice",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="number of processes used to find sections")
+    parser.add_argument(
+        "--section-threads",
+        type=int,
+        help="number of threads used to find sections with the brep engine, threads share shapes without copying "
+        "them. Sections are found without threads by default",
+    )
+    parser.add_argument(
+        "--instancing",
+        action="store_true",
+        help="build shapes of elements sharing a mapped representation once and reuse their sections",
+    )
+    parser.add_argument(
+        "--curve-tolerance",
+        type=float,
+        default=0.005,
+        help="maximum distance in meters between curved section edges and the polylines approximating them",
+    )
+    parser.add_argument("--tile-size", type=int, default=256, help="tile width and height of FloorTilesFormatter")
+    parser.add_argument(
+        "--tile-resolution",
+        type=float,
+        default=0.01,
+        help="meters per pixel FloorTilesFormatter's deepest zoom level reaches",
+    )
+    parser.add_argument(
+        "--tile-threads", type=int, help="number of threads rendering tiles, by default based on the CPU count"
+    )
+    parser.add_argument("--report", action="store_true", help="write timings and counters of every file to report.json")
+    parser.add_argument(
+        "--profile", choices=["cprofile", "pyinstrument"], help="profile every file and write the result next to it"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip levels and formatters the run journal of the output directory records as finished with the same "
+        "inputs",
+    )
+    parser.add_argument("--max-memory", type=float, help="memory limit in megabytes, allocations beyond it fail")
+    return parser
 
+
+def create_context(args):
     context = {}
     context["args"] = args
 
@@ -188,13 +772,9 @@ def main():
             print(f"Importing the plugin failed: {e}")
             exit()
 
-    display = init_display(
-        size=(int(args.width), int(args.height)),
-        display_triedron=False,
-        background_gradient_color1=[255, 255, 255],
-        background_gradient_color2=[255, 255, 255],
-    )[0]
-    context["display"] = display
+    context["display"] = None
+    if not args.no_display:
+        context["display"] = create_display(int(args.width), int(args.height), offscreen=args.offscreen)
 
     filter_fn = None
     if hasattr(plugin, args.filter_fn):
@@ -205,47 +785,135 @@ def main():
 
     if args.use_storey and args.filter is not None:
         print("Warning: filter and use_storey options don't work together as expected.")
+    if args.use_storey and args.streaming:
+        print("Warning: streaming option is ignored when use_storey is given.")
     context["filter"] = args.filter
+    context["geom_threads"] = args.geom_threads
+    context["workers"] = args.workers
+    context["section_threads"] = args.section_threads
+    if args.section_threads is not None and args.section_threads < 1:
+        raise ValueError("section_threads option must be at least 1")
+    if args.section_threads is not None and not hasattr(fixes, "SectionShapesToFaces"):
+        print("Warning: section_threads option is ignored since the fixes module doesn't have SectionShapesToFaces.")
+        context["section_threads"] = None
+    if args.section_threads is not None and args.workers > 1:
+        print("Warning: section_threads option is ignored when workers is given.")
+    if args.section_threads is not None and args.section_engine != "brep":
+        print("Warning: section_threads option only works with the brep section engine.")
+    context["section_engine"] = args.section_engine
+    context["parallel_section"] = args.parallel_section
+    context["mesh_deflection"] = args.mesh_deflection
+    context["instancing"] = args.instancing
+    context["discretizer"] = Discretizer(deflection=args.curve_tolerance)
+    context["journal"] = RunJournal(Path(args.output) / "journal.jsonl")
 
     if hasattr(plugin, args.color_fn):
         color_fn = getattr(plugin, args.color_fn)
     else:
         color_fn = getattr(stylings, args.color_fn)
-    context["color_fn"] = color_fn()
-
-    if len(args.formatter) == 0:
+    color_kwargs = {}
+    if args.color_mapping is not None:
+        if not takes_argument(color_fn, "mapping_path"):
+            raise ValueError(f"Color function {args.color_fn} doesn't take a mapping file (mapping_path)")
+        color_kwargs["mapping_path"] = args.color_mapping
+    context["color_fn"] = color_fn(**color_kwargs)
+    context["styles"] = StyleResolver(context["color_fn"], skip_colorless=args.skip_colorless)
+
+    if len(args.formatter) == 0 and args.no_display:
+        selected_formatters = ["FloorRasterFormatter"]
+    elif len(args.formatter) == 0:
         selected_formatters = ["FloorPlanFormatter", "Floor3DFormatter"]
     else:
         selected_formatters = args.formatter
     context["formatters"] = []
+    context["args_keys"] = {}
     for name in selected_formatters:
         if hasattr(plugin, name):
             Formatter = getattr(plugin, name)
         else:
             Formatter = getattr(formatters, name)
         context["formatters"].append(Formatter(context))
+        # formatters of plugins not declaring their options depend on all of them
+        options = getattr(Formatter, "options", FORMATTER_ARGS)
+        context["args_keys"][Formatter.__name__] = get_args_key(args, options)
+    return context
+
+
+# finds levels of the model and runs the selected mode on the ones not done yet
+def process_model(context):
+    args = context["args"]
+    ifc_path = context["ifc_path"]
+    if args.use_storey:
+        context["model_fingerprints"] = get_model_fingerprints(context)
+        process_using_storeys(context)
+    else:
+        level_file = ifc_path.parent / f"{ifc_path.stem}.csv"
+        context["level_file"] = level_file
+        if not level_file.exists():
+            raise ValueError(f"Level file doesn't exist: {level_file}")
+        columns = ["l", "e"]
+        levels = pd.read_csv(level_file, names=columns).to_dict("records")
+        levels = [(l0["l"], (l0["e"] + l1["e"]) / 2000) for l0, l1 in zip(levels[:-1], levels[1:])]
+        context["model_fingerprints"] = get_model_fingerprints(context, levels)
+        context["levels"] = [level for level in levels if len(get_pending_formatters(context, *level)) > 0]
+        skipped = len(levels) - len(context["levels"])
+        if skipped > 0:
+            print(f"Skipping {skipped} of {len(levels)} levels, their outputs are up to date")
+        if len(context["levels"]) > 0:
+            if args.streaming:
+                process_streaming(context)
+            else:
+                process(context)
+
+
+def process_file(context, ifc_path):
+    args = context["args"]
+    print(f"Processing: {ifc_path}")
+    ifc_path = Path(ifc_path)
+    output_dir = Path(args.output) / ifc_path.stem
+    output_dir.mkdir(parents=True, exist_ok=True)
+    context["output_dir"] = output_dir
+    context["ifc_path"] = ifc_path
+    context["file_hash"] = get_file_hash(ifc_path)
+    context["journal_key"] = str(ifc_path.resolve())
+    context["styles"].clear()
+    context["discretizer"].edges.clear()
+    context["shape_cache"] = None
+    if args.cache_dir is not None:
+        context["shape_cache"] = ShapeCache(
+            args.cache_dir, ifc_path, max_size=args.cache_size * 1024 * 1024, section_key=get_section_key(args)
+        )
+    recorder.reset()
+    with profile(args.profile, output_dir / "profile"), stage("file"):
+        process_model(context)
+        finish_formatters(context)
+    if context["shape_cache"] is not None:
+        shape_cache = context["shape_cache"]
+        print(f"Shape cache: {shape_cache.hits} hits, {shape_cache.misses} misses")
+        print(f"Section cache: {shape_cache.section_hits} hits, {shape_cache.section_misses} misses")
+        count("shape_cache_hits", shape_cache.hits)
+        count("shape_cache_misses", shape_cache.misses)
+        shape_cache.evict()
+    if args.report:
+        recorder.write_report(output_dir / "report.json", ifc=str(ifc_path))
+    # per file objects are dropped here, OCC wrappers kept in reference cycles are only freed by the collector
+    for key in ("shape_cache", "levels", "level_file", "file_hash", "journal_key", "model_fingerprints"):
+        context.pop(key, None)
+    gc.collect()
+    print(f"RSS: {get_rss():.1f} MB, Peak RSS: {get_peak_rss():.1f} MB")
+
+
+def main():
+    args = get_parser().parse_args()
+    if args.max_memory is not None:
+        limit_memory(args.max_memory)
+    context = create_context(args)
 
     ifc_paths = glob.glob(args.ifc_paths)
     if len(ifc_paths) == 0:
         print("No IFC file found!")
     for ifc_path in ifc_paths:
-        print(f"Processing: {ifc_path}")
-        ifc_path = Path(ifc_path)
-        output_dir = Path(args.output) / ifc_path.stem
-        output_dir.mkdir(parents=True, exist_ok=True)
-        context["output_dir"] = output_dir
-        context["ifc_path"] = ifc_path
-        if args.use_storey:
-            process_using_storeys(context)
-        else:
-            level_file = ifc_path.parent / f"{ifc_path.stem}.csv"
-            context["level_file"] = level_file
-            if not level_file.exists():
-                raise ValueError(f"Level file doesn't exist: {level_file}")
-            columns = ["l", "e"]
-            levels = pd.read_csv(level_file, names=columns).to_dict("records")
-            context["levels"] = [(l0["l"], (l0["e"] + l1["e"]) / 2000) for l0, l1 in zip(levels[:-1], levels[1:])]
-            process(context)
+        process_file(context, ifc_path)
 
 
 # TODO Merge mark_floor plans and extract_floor_plans with Fire and name the combined program as BatchPlan
@@ -1,122 +1,466 @@
+import json
+import math
+import shutil
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import groupby
 
+import numpy as np
 import pandas as pd
-from OCC.Core.BRep import BRep_Tool
-from OCC.Core.BRepTools import breptools
-from OCC.Display.OCCViewer import rgb_color
-from OCC.Extend.TopologyUtils import WireExplorer
-from shapely import MultiPolygon, Polygon, to_wkt
+import shapely
+from matplotlib.image import imsave
+from OCC.Display.OCCViewer import OffscreenRenderer, rgb_color
+from OCC.Display.SimpleGui import init_display
 
-# os.environ["PYTHONOCC_OFFSCREEN_RENDERER"] = "1"
+from .instrumentation import count, stage
+from .raster import rasterize
+from .utils import get_bounding_box, get_face_rings, get_multipolygons
+from .vector import PDFWriter, SVGWriter
 
 
-def draw_sections(display, elements, shapes, shape_faces, color_fn=None, skip_colorless=False):
-    for element, shape, faces in zip(elements, shapes, shape_faces):
-        if color_fn is None:
-            r, g, b, a = shape.styles[0]
-            if r < 0 or g < 0 or b < 0 or a < 0:
-                continue
+# offscreen display renders into a framebuffer without a window, so no Qt application is created
+def create_display(width, height, offscreen=False):
+    if offscreen:
+        display = OffscreenRenderer(screen_size=(width, height))
+        display.set_bg_gradient_color([255, 255, 255], [255, 255, 255])
+        display.hide_triedron()
+        return display
+    return init_display(
+        size=(width, height),
+        display_triedron=False,
+        background_gradient_color1=[255, 255, 255],
+        background_gradient_color2=[255, 255, 255],
+    )[0]
+
+
+# EraseAll only hides displayed objects, they stay in the interactive context together with their shapes and
+# presentations, so a long running display grows with every level drawn. Removing them releases the shapes.
+def clear_display(display):
+    display.Context.RemoveAll(False)
+    display.EraseAll()
+
+
+# returns the RGBA color of an element or None if the element shouldn't be drawn
+def get_color(element, shape, color_fn=None, skip_colorless=False):
+    if color_fn is None:
+        r, g, b, a = shape.styles[0]
+        if r < 0 or g < 0 or b < 0 or a < 0:
+            return None
+        return r, g, b, a
+    color, found = color_fn(element, shape)
+    if skip_colorless and not found:
+        return None
+    return color
+
+
+# resolves elements' colors once per file keyed by GlobalId, so that the overview, the 3D views and the sections
+# of every level share them. A color function may have a batch attribute which takes lists of elements and shapes
+# and returns their (color, found) pairs to color many elements in one call.
+class StyleResolver:
+    def __init__(self, color_fn=None, skip_colorless=False):
+        self.color_fn = color_fn
+        self.skip_colorless = skip_colorless
+        self.colors = {}
+
+    # GlobalIds are only unique within a model
+    def clear(self):
+        self.colors.clear()
+
+    def get_colors(self, elements, shapes):
+        missing = [i for i, element in enumerate(elements) if element.GlobalId not in self.colors]
+        batch = getattr(self.color_fn, "batch", None)
+        if len(missing) > 0 and batch is not None:
+            results = batch([elements[i] for i in missing], [shapes[i] for i in missing])
+            for i, (color, found) in zip(missing, results):
+                self.colors[elements[i].GlobalId] = None if self.skip_colorless and not found else tuple(color)
         else:
-            (r, g, b, a), found = color_fn(element, shape)
-            if skip_colorless and not found:
-                continue
+            for i in missing:
+                self.colors[elements[i].GlobalId] = get_color(
+                    elements[i], shapes[i], self.color_fn, self.skip_colorless
+                )
+        return [self.colors[element.GlobalId] for element in elements]
+
+
+def get_colors(elements, shapes, color_fn=None, skip_colorless=False, styles=None):
+    if styles is not None:
+        return styles.get_colors(elements, shapes)
+    return [get_color(element, shape, color_fn, skip_colorless) for element, shape in zip(elements, shapes)]
+
+
+# shapes are displayed without updating the viewer, updating after every shape redraws all of the shapes
+# displayed before it. Callers fit and repaint the view once before exporting.
+def draw_sections(display, elements, shapes, shape_faces, color_fn=None, skip_colorless=False, styles=None):
+    colors = get_colors(elements, shapes, color_fn, skip_colorless, styles)
+    for color, faces in zip(colors, shape_faces):
+        if color is None:
+            continue
+        r, g, b, a = color
         color = rgb_color(r, g, b)
         for face in faces:
-            display.DisplayShape(face, color=color, transparency=abs(1 - a))
+            display.DisplayShape(face, color=color, transparency=abs(1 - a), update=False)
 
 
-def draw_shapes(display, elements, shapes, color_fn=None, skip_colorless=False):
-    for element, shape in zip(elements, shapes):
+def draw_shapes(display, elements, shapes, color_fn=None, skip_colorless=False, styles=None):
+    colors = get_colors(elements, shapes, color_fn, skip_colorless, styles)
+    for element, shape, color in zip(elements, shapes, colors):
         try:
             geometry = shape.geometry
-            if color_fn is None:
-                r, g, b, a = shape.styles[0]
-                if r < 0 or g < 0 or b < 0 or a < 0:
-                    continue
-            else:
-                (r, g, b, a), found = color_fn(element, shape)
-                if skip_colorless and not found:
-                    continue
-            color = rgb_color(r, g, b)
-            display.DisplayShape(geometry, color=color, transparency=abs(1 - a))
+            if color is None:
+                continue
+            r, g, b, a = color
+            display.DisplayShape(geometry, color=rgb_color(r, g, b), transparency=abs(1 - a), update=False)
         except RuntimeError as e:
             print(f"Exception: name={element.Name}, exception={e}")
 
 
 class Formatter:
+    # formatters writing one output per model instead of one per level are finished after the last level
+    per_model = False
+    # arguments of journal.FORMATTER_ARGS the formatter's outputs depend on
+    options = ()
+
     @abstractmethod
     def process(self, name, elements, shapes, faces):
         raise NotImplementedError()
 
+    def finish(self):
+        pass
+
+    # file or directory written for a level, resuming redoes the level if it has been removed. None if unknown.
+    def get_output_path(self, name):
+        return None
+
 
 class FloorPlanFormatter(Formatter):
+    options = ("width", "height")
+
     def __init__(self, context):
         self.context = context
         self.display = context["display"]
+        if self.display is None:
+            raise ValueError(f"{type(self).__name__} needs a display")
+
+    def get_output_path(self, name):
+        return self.context["output_dir"] / f"{name}_floor_plan.png"
 
     def process(self, name, elements, shapes, faces):
-        self.display.EraseAll()
+        clear_display(self.display)
         draw_sections(
             self.display,
             elements,
             shapes,
             faces,
-            color_fn=self.context["color_fn"],
-            skip_colorless=self.context["args"].skip_colorless,
+            styles=self.context["styles"],
         )
         self.display.View_Top()
         self.display.FitAll()
-        path_to_export = str(self.context["output_dir"] / f"{name}_floor_plan.png")
-        self.display.ExportToImage(path_to_export)
+        self.display.Repaint()
+        path_to_export = str(self.get_output_path(name))
+        with stage("export_image"):
+            self.display.ExportToImage(path_to_export)
 
 
 class Floor3DFormatter(Formatter):
+    options = ("width", "height")
+
     def __init__(self, context):
         self.context = context
         self.display = context["display"]
+        if self.display is None:
+            raise ValueError(f"{type(self).__name__} needs a display")
+
+    def get_output_path(self, name):
+        return self.context["output_dir"] / f"{name}_3D.png"
 
     def process(self, name, elements, shapes, _):
-        self.display.EraseAll()
+        clear_display(self.display)
         draw_shapes(
             self.display,
             elements,
             shapes,
-            color_fn=self.context["color_fn"],
-            skip_colorless=self.context["args"].skip_colorless,
+            styles=self.context["styles"],
         )
         self.display.View_Iso()
         self.display.FitAll()
-        path_to_export = str(self.context["output_dir"] / f"{name}_3D.png")
-        self.display.ExportToImage(path_to_export)
+        self.display.Repaint()
+        path_to_export = str(self.get_output_path(name))
+        with stage("export_image"):
+            self.display.ExportToImage(path_to_export)
+
+
+# draws floor plans by filling section faces into a NumPy image, doesn't need a display
+class FloorRasterFormatter(Formatter):
+    options = ("width", "height")
+
+    def __init__(self, context):
+        self.context = context
+
+    def get_output_path(self, name):
+        return self.context["output_dir"] / f"{name}_floor_plan.png"
+
+    def process(self, name, elements, shapes, faces):
+        polygons = []
+        colors = self.context["styles"].get_colors(elements, shapes)
+        for color, element_faces in zip(colors, faces):
+            if color is None:
+                continue
+            # alpha is ignored, faces are painted opaque
+            rgb = np.round(np.asarray(color[:3]) * 255).astype(np.uint8)
+            for face in element_faces:
+                polygons.append((get_face_rings(face, self.context["discretizer"]), rgb))
+        args = self.context["args"]
+        with stage("rasterize"):
+            image = rasterize(polygons, int(args.width), int(args.height))
+        path_to_export = str(self.get_output_path(name))
+        with stage("write"):
+            imsave(path_to_export, image)
+
+
+# writes section faces of a level as vector paths, one path per element with the element's color, grouped by IFC
+# type. Rings of an element are discretized right before its path is written, so the whole level is never kept
+# as text or polygons in memory.
+class FloorVectorFormatter(Formatter):
+    suffix = None
+    mode = "w"
+    Writer = None
+
+    def __init__(self, context):
+        self.context = context
+
+    def get_output_path(self, name):
+        return self.context["output_dir"] / f"{name}_floor_plan{self.suffix}"
+
+    def process(self, name, elements, shapes, faces):
+        colors = self.context["styles"].get_colors(elements, shapes)
+        items = [
+            (element.is_a(), element, color, element_faces)
+            for element, color, element_faces in zip(elements, colors, faces)
+            if color is not None and len(element_faces) > 0
+        ]
+        items.sort(key=lambda item: item[0])
+        bbox = (0.0, 0.0, 1.0, 1.0)
+        if len(items) > 0:
+            xmin, ymin, _, xmax, ymax, _ = get_bounding_box(face for item in items for face in item[3])
+            bbox = (xmin, ymin, xmax, ymax)
+        discretizer = self.context["discretizer"]
+        path_to_export = self.get_output_path(name)
+        with stage("write"), path_to_export.open(self.mode) as f:
+            writer = self.Writer(f, bbox)
+            for ifc_type, group in groupby(items, key=lambda item: item[0]):
+                writer.begin_group(ifc_type)
+                for _, element, color, element_faces in group:
+                    rings = [ring for face in element_faces for ring in get_face_rings(face, discretizer)]
+                    writer.write_path(rings, color, element.GlobalId, element.Name)
+                writer.end_group()
+            writer.close()
+
+
+class FloorSVGFormatter(FloorVectorFormatter):
+    suffix = ".svg"
+    Writer = SVGWriter
+
+
+class FloorPDFFormatter(FloorVectorFormatter):
+    suffix = ".pdf"
+    mode = "wb"
+    Writer = PDFWriter
+
+
+# offsets of a tile's four children at the next zoom
+TILE_CHILDREN = np.array([(0, 0), (1, 0), (0, 1), (1, 1)])
+
+
+# renders each level into a pyramid of fixed size PNG tiles, <level>_tiles/<zoom>/<x>/<y>.png, in the layout of
+# slippy maps: zoom 0 is a single tile covering the level and every zoom halves the tiles' side, x grows to the
+# right and y downwards. Faces are looked up per tile in an STRtree of their bounds. Tiles without faces are
+# skipped and only the tiles with faces are split into their four children at the next zoom, so empty parts of
+# the level are never visited. Tiles are rendered in a thread pool since filling polygons and compressing PNGs
+# release the GIL.
+class FloorTilesFormatter(Formatter):
+    options = ("tile_size", "tile_resolution")
+
+    def __init__(self, context):
+        self.context = context
+
+    def get_output_path(self, name):
+        return self.context["output_dir"] / f"{name}_tiles"
+
+    def process(self, name, elements, shapes, faces):
+        args = self.context["args"]
+        tile_size = args.tile_size
+        polygons = []
+        colors = self.context["styles"].get_colors(elements, shapes)
+        for color, element_faces in zip(colors, faces):
+            if color is None:
+                continue
+            # alpha is ignored, faces are painted opaque
+            rgb = np.round(np.asarray(color[:3]) * 255).astype(np.uint8)
+            for face in element_faces:
+                rings = [ring for ring in get_face_rings(face, self.context["discretizer"]) if len(ring) >= 3]
+                if len(rings) > 0:
+                    polygons.append((rings, rgb))
+
+        tiles_dir = self.get_output_path(name)
+        if tiles_dir.exists():
+            shutil.rmtree(tiles_dir)
+        tiles_dir.mkdir(parents=True)
+        if len(polygons) == 0:
+            return
+
+        bounds = np.array([(*rings[0].min(axis=0), *rings[0].max(axis=0)) for rings, _ in polygons])
+        tree = shapely.STRtree(shapely.box(*bounds.T))
+        xmin, ymin = bounds[:, :2].min(axis=0)
+        xmax, ymax = bounds[:, 2:].max(axis=0)
+        side = max(xmax - xmin, ymax - ymin, 1e-6)
+        max_zoom = get_max_zoom(side, tile_size, args.tile_resolution)
+        # the pyramid is a square centered on the level
+        x0 = (xmin + xmax - side) / 2
+        y1 = (ymin + ymax + side) / 2
+
+        def render_tile(zoom, tile):
+            x, y = (int(v) for v in tile)
+            tile_side = side / 2**zoom
+            tile_bbox = (x0 + x * tile_side, y1 - (y + 1) * tile_side, x0 + (x + 1) * tile_side, y1 - y * tile_side)
+            indices = tree.query(shapely.box(*tile_bbox))
+            if len(indices) == 0:
+                return False
+            # faces are drawn in their original order so that overlaps look the same in every tile
+            image = rasterize([polygons[i] for i in np.sort(indices)], tile_size, tile_size, tile_bbox, margin=0)
+            path = tiles_dir / str(zoom) / str(x) / f"{y}.png"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            imsave(str(path), image)
+            return True
+
+        written = 0
+        with stage("render_tiles"), ThreadPoolExecutor(args.tile_threads) as executor:
+            found = None
+            for zoom in range(max_zoom + 1):
+                zoom_found = []
+                for tiles in iter_tile_batches(found, zoom):
+                    rendered = list(executor.map(partial(render_tile, zoom), tiles))
+                    zoom_found.append(tiles[np.array(rendered, dtype=bool)])
+                found = np.concatenate(zoom_found)
+                written += len(found)
+                if len(found) == 0:
+                    break
+        count("tiles", written)
+
+        metadata = {
+            "tile_size": tile_size,
+            "min_zoom": 0,
+            "max_zoom": max_zoom,
+            "bounds": [x0, y1 - side, x0 + side, y1],
+            "resolutions": [side / 2**zoom / tile_size for zoom in range(max_zoom + 1)],
+            "tiles": int(written),
+            "url": "{z}/{x}/{y}.png",
+        }
+        (tiles_dir / "tiles.json").write_text(json.dumps(metadata, indent=2))
+
+
+# yields (n, 2) arrays of tiles of the zoom to render, at most batch_size at a time so that the pool never holds
+# more futures than that. Zoom 0 is the single tile covering the level, the tiles of the other zooms are the
+# children of the parent tiles, the tiles of the previous zoom which had faces.
+def iter_tile_batches(parents, zoom, batch_size=1024):
+    if zoom == 0:
+        yield np.zeros((1, 2), dtype=np.int64)
+        return
+    step = max(1, batch_size // 4)
+    for start in range(0, len(parents), step):
+        chunk = parents[start : start + step]
+        yield (2 * chunk[:, None, :] + TILE_CHILDREN[None]).reshape(-1, 2)
+
+
+# the smallest zoom whose pixels are at most resolution meters wide
+def get_max_zoom(side, tile_size, resolution, limit=12):
+    zoom = math.ceil(math.log2(max(side / (tile_size * resolution), 1)))
+    return min(zoom, limit)
 
 
-# TODO Handle curves
 class FloorWKTFormatter(Formatter):
     def __init__(self, context):
         self.context = context
 
+    def get_output_path(self, name):
+        return self.context["output_dir"] / f"{name}.csv"
+
     def process(self, name, elements, _, faces):
-        data = {"type": [], "name": [], "geometry": []}
-        for element, faces in zip(elements, faces):
-            polygons = []
-            for face in faces:
-                wire = breptools.OuterWire(face)
-                we = WireExplorer(wire)
-                points = []
-                vertices = we.ordered_vertices()
-                for vertex in vertices:
-                    point = BRep_Tool.Pnt(vertex)
-                    points.append((point.X(), point.Y()))
-                if len(points) < 3:
-                    continue
-                polygon = Polygon(points)
-                polygons.append(polygon)
-            if len(polygons) == 0:
-                continue
-            wkt = to_wkt(MultiPolygon(polygons))
-            data["geometry"].append(wkt)
-            data["type"].append(element.is_a())
-            data["name"].append(element.Name)
+        multipolygons = get_multipolygons(faces, self.context["discretizer"])
+        found = ~shapely.is_missing(multipolygons)
+        elements = [element for element, f in zip(elements, found) if f]
+        data = {
+            "type": [element.is_a() for element in elements],
+            "name": [element.Name for element in elements],
+            "geometry": shapely.to_wkt(multipolygons[found]),
+        }
         df = pd.DataFrame(data)
-        path_to_export = str(self.context["output_dir"] / f"{name}.csv")
-        df.to_csv(path_to_export, index=False)
+        path_to_export = str(self.get_output_path(name))
+        with stage("write"):
+            df.to_csv(path_to_export, index=False)
+
+
+# writes sections of all levels into one GeoParquet file per model with a row per element and level. Geometries
+# are built with Shapely's vectorized constructors including holes and stored as WKB, rows are written level by
+# level as row groups so that the whole model is never kept in memory.
+class FloorGeoParquetFormatter(Formatter):
+    per_model = True
+
+    def __init__(self, context):
+        # pyarrow is only needed by this formatter
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.pq = pq
+        self.context = context
+        self.writer = None
+        self.path = None
+
+    # the file of the whole model, whatever the level
+    def get_output_path(self, name):
+        return self.context["output_dir"] / f"{self.context['ifc_path'].stem}.parquet"
+
+    def get_schema(self):
+        pa = self.pa
+        # coordinates are in the model's local coordinate system, so the CRS is unknown
+        geo = {
+            "version": "1.0.0",
+            "primary_column": "geometry",
+            "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["MultiPolygon"], "crs": None}},
+        }
+        return pa.schema(
+            [
+                ("level", pa.string()),
+                ("type", pa.string()),
+                ("name", pa.string()),
+                ("global_id", pa.string()),
+                ("geometry", pa.binary()),
+            ],
+            metadata={"geo": json.dumps(geo)},
+        )
+
+    def process(self, name, elements, _, faces):
+        multipolygons = get_multipolygons(faces, self.context["discretizer"])
+        found = ~shapely.is_missing(multipolygons)
+        if not found.any():
+            return
+        elements = [element for element, f in zip(elements, found) if f]
+        data = {
+            "level": [str(name)] * len(elements),
+            "type": [element.is_a() for element in elements],
+            "name": [element.Name for element in elements],
+            "global_id": [element.GlobalId for element in elements],
+            "geometry": shapely.to_wkb(multipolygons[found]),
+        }
+        schema = self.get_schema()
+        if self.writer is None:
+            self.path = self.get_output_path(name)
+            self.writer = self.pq.ParquetWriter(str(self.path), schema)
+        with stage("write"):
+            self.writer.write_table(self.pa.table(data, schema=schema))
+
+    def finish(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
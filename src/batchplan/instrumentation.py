@@ -0,0 +1,124 @@
+import heapq
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from .memory import get_peak_rss, get_rss
+
+
+# collects wall and CPU times of stages, counters and the slowest elements of a file. Times of nested stages are
+# included in their parents' times and CPU times are of the whole process, so they include other threads' work.
+class Recorder:
+    def __init__(self, max_elements=20):
+        self.max_elements = max_elements
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.counters = Counter()
+            self.elements = []
+
+    @contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            with self.lock:
+                stats = self.stages.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0})
+                stats["calls"] += 1
+                stats["wall"] += wall
+                stats["cpu"] += cpu
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    # keeps the slowest elements in a min-heap bounded by max_elements
+    def record_element(self, stage, element, seconds):
+        item = (seconds, stage, element.GlobalId, element.is_a())
+        with self.lock:
+            if len(self.elements) < self.max_elements:
+                heapq.heappush(self.elements, item)
+            elif seconds > self.elements[0][0]:
+                heapq.heapreplace(self.elements, item)
+
+    def get_report(self):
+        with self.lock:
+            stages = {
+                name: {"calls": s["calls"], "wall": round(s["wall"], 6), "cpu": round(s["cpu"], 6)}
+                for name, s in sorted(self.stages.items(), key=lambda item: -item[1]["wall"])
+            }
+            slowest = [
+                {"global_id": global_id, "type": element_type, "stage": stage, "seconds": round(seconds, 6)}
+                for seconds, stage, global_id, element_type in sorted(self.elements, reverse=True)
+            ]
+            return {
+                "stages": stages,
+                "counters": dict(self.counters),
+                "slowest_elements": slowest,
+                "rss_mb": round(get_rss(), 1),
+                "peak_rss_mb": round(get_peak_rss(), 1),
+            }
+
+    def write_report(self, path, **extra):
+        report = {**extra, **self.get_report()}
+        path.write_text(json.dumps(report, indent=2))
+
+
+# a module level recorder lets stages deep in utils and formatters be timed without passing it around
+recorder = Recorder()
+
+
+def stage(name):
+    return recorder.stage(name)
+
+
+def count(name, n=1):
+    recorder.count(name, n)
+
+
+@contextmanager
+def time_element(stage, element):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.record_element(stage, element, time.perf_counter() - start)
+
+
+# profiles the block with cProfile (written as pstats to path.prof) or pyinstrument (written as HTML to path.html)
+@contextmanager
+def profile(kind, path):
+    if kind is None:
+        yield
+    elif kind == "cprofile":
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(str(path.with_suffix(".prof")))
+    elif kind == "pyinstrument":
+        # pyinstrument is optional
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path.with_suffix(".html").write_text(profiler.output_html())
+    else:
+        raise ValueError(f"Unknown profiler: {kind}")
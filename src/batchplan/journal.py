@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# arguments which only change how outputs are created, not the outputs themselves
+EXECUTION_ARGS = {
+    "ifc_paths",
+    "output",
+    "resume",
+    "geom_threads",
+    "workers",
+    "section_threads",
+    "tile_threads",
+    "cache_dir",
+    "cache_size",
+    "streaming",
+    "parallel_section",
+    "offscreen",
+    "report",
+    "profile",
+    "max_memory",
+}
+
+
+# arguments read by some formatters only, a formatter's outputs only depend on the ones in its options
+FORMATTER_ARGS = {"width", "height", "tile_size", "tile_resolution"}
+
+
+# arguments naming files whose content the outputs depend on, they are fingerprinted by their content hashes
+CONTENT_ARGS = {"color_mapping"}
+
+
+def get_content_hash(path):
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+# options the outputs of a formatter depend on: the shared ones and the formatter's own ones. The selected
+# formatters aren't included since every formatter's outputs are recorded on their own.
+def get_args_key(args, formatter_options=()):
+    options = {
+        name: value
+        for name, value in vars(args).items()
+        if name not in EXECUTION_ARGS
+        and name != "formatter"
+        and (name not in FORMATTER_ARGS or name in formatter_options)
+    }
+    for name in CONTENT_ARGS:
+        if options.get(name) is not None:
+            options[name] = get_content_hash(options[name])
+    return json.dumps(options, sort_keys=True, default=str)
+
+
+# level name of outputs covering the whole model
+MODEL_LEVEL = "*"
+
+
+# fingerprint of everything a level's outputs depend on: the IFC file's content, the options and the section height
+def get_level_fingerprint(file_hash, args_key, section_height):
+    return hashlib.sha256(f"{file_hash}:{args_key}:{section_height:.6f}".encode()).hexdigest()
+
+
+# levels are None when they are inferred from the IFC file itself
+def get_model_fingerprint(file_hash, args_key, levels=None):
+    return hashlib.sha256(f"{file_hash}:{args_key}:{json.dumps(levels, default=str)}".encode()).hexdigest()
+
+
+# append-only record of finished (file, level, formatter) outputs, the last record of an output wins. Every record
+# is a single line written at once so that runs sharing an output directory can append at the same time. Records
+# keep the paths written relative to the journal's directory, an output is only done while they all exist.
+class RunJournal:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.done = {}
+        if self.path.exists():
+            text = self.path.read_text()
+            if len(text) > 0 and not text.endswith("\n"):
+                # terminates the incomplete line of an interrupted run so that new records start on their own line
+                with self.path.open("a") as f:
+                    f.write("\n")
+            for line in text.splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of an interrupted run may be incomplete
+                    continue
+                key = (record["ifc"], record["level"], record["formatter"])
+                self.done[key] = (record["fingerprint"], record.get("outputs", []))
+
+    def is_done(self, ifc, level, formatter, fingerprint):
+        done = self.done.get((ifc, level, formatter))
+        if done is None or done[0] != fingerprint:
+            return False
+        return all((self.path.parent / output).exists() for output in done[1])
+
+    def record(self, ifc, level, formatter, fingerprint, outputs=()):
+        outputs = [os.path.relpath(output, self.path.parent) for output in outputs]
+        record = {"ifc": ifc, "level": level, "formatter": formatter, "fingerprint": fingerprint, "outputs": outputs}
+        with self.path.open("a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done[(ifc, level, formatter)] = (fingerprint, outputs)
@@ -0,0 +1,90 @@
+import argparse
+import gc
+import time
+from collections import Counter
+from pathlib import Path
+
+import pandas as pd
+from OCC.Core.AIS import AIS_ListOfInteractive
+
+from .extract_floor_plans import create_context, get_parser, process_file
+from .memory import get_peak_rss, get_rss
+
+
+# counts live Python wrappers of OCC objects by type, wrappers keep their C++ objects alive
+def count_occ_objects():
+    return Counter(type(o).__name__ for o in gc.get_objects() if type(o).__module__.startswith("OCC."))
+
+
+# counts every object known by the interactive context including the erased ones
+def count_display_objects(display):
+    if display is None:
+        return 0
+    objects = AIS_ListOfInteractive()
+    display.Context.ObjectsInside(objects)
+    return objects.Size()
+
+
+def get_slope(values):
+    if len(values) < 2:
+        return 0.0
+    return (values[-1] - values[0]) / (len(values) - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="processes the same IFC file again and again in one process and records memory usage per "
+        "iteration, unknown arguments are passed to extract_floor_plans"
+    )
+    parser.add_argument("ifc_path")
+    parser.add_argument("--iterations", type=int, default=10, help="number of times the file is processed")
+    parser.add_argument("--report", default="leak_check.csv", help="report file name in the output directory")
+    parser.add_argument("--top", type=int, default=10, help="number of growing OCC types printed")
+    args, extract_args = parser.parse_known_args()
+    if args.iterations < 1:
+        parser.error("--iterations must be at least 1")
+
+    extract_args = get_parser().parse_args([args.ifc_path, *extract_args])
+    context = create_context(extract_args)
+
+    rows = []
+    first_counts = None
+    for i in range(args.iterations):
+        start = time.perf_counter()
+        process_file(context, args.ifc_path)
+        duration = time.perf_counter() - start
+        gc.collect()
+        counts = count_occ_objects()
+        if first_counts is None:
+            first_counts = counts
+        rows.append(
+            {
+                "iteration": i,
+                "duration": round(duration, 3),
+                "rss_mb": round(get_rss(), 1),
+                "peak_rss_mb": round(get_peak_rss(), 1),
+                "occ_objects": sum(counts.values()),
+                "display_objects": count_display_objects(context["display"]),
+            }
+        )
+        print(f"Iteration {i}: {rows[-1]}")
+
+    report_path = Path(extract_args.output) / args.report
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    df = pd.DataFrame(rows)
+    df.to_csv(report_path, index=False)
+
+    # the first iteration fills caches and pools, growth is measured after it
+    rest = df.iloc[1:]
+    print(f"RSS growth per iteration: {get_slope(rest['rss_mb'].tolist()):.2f} MB")
+    print(f"OCC object growth per iteration: {get_slope(rest['occ_objects'].tolist()):.1f}")
+    grown = (counts - first_counts).most_common(args.top)
+    if len(grown) > 0:
+        print("Growing OCC types since the first iteration:")
+        for name, count in grown:
+            print(f"  {name}: +{count}")
+    print(f"Report: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,50 +4,48 @@ import functools
 from pathlib import Path
 
 import ifcopenshell
-import ifcopenshell.geom
 from ifcopenshell.util.placement import get_storey_elevation
 from OCC.Display.OCCViewer import rgb_color
 from OCC.Display.SimpleGui import init_display
 from PyQt5.QtWidgets import QApplication, QLabel, QMainWindow
 
-from .utils import get_bounding_box
+from .cache import ShapeCache
+from .formatters import clear_display
+from .utils import get_bounding_box, get_elements_and_shapes
 
 display = None
 main_window = None
 
-settings = ifcopenshell.geom.settings()
-settings.set(settings.USE_PYTHON_OPENCASCADE, True)
-
 shape_to_element = {}
 floors = []
 
 
-def load_ifc(ifc_file, use_storeys):
+def load_ifc(ifc_file, use_storeys, cache_dir=None):
     global shape_to_element, floors
 
     shape_to_element = {}
     floors = []
-    display.EraseAll()
+    clear_display(display)
 
     print(f"Loading {ifc_file}")
     model = ifcopenshell.open(ifc_file)
-    for el in model.by_type("IfcSlab"):
-        if el.Representation is None or el.is_a() == "IfcSpace":
-            continue
+    cache = ShapeCache(cache_dir, ifc_file) if cache_dir is not None else None
+    elements, shapes = get_elements_and_shapes(
+        model.by_type("IfcSlab"), filter_fn=lambda el: el.Representation is not None, cache=cache
+    )
+    for el, shape in zip(elements, shapes):
         try:
-            shape = ifcopenshell.geom.create_shape(settings, el)
             geometry = shape.geometry
             shape_to_element[geometry] = el
             r, g, b, a = shape.styles[0]
             if r < 0 or g < 0 or b < 0 or a < 0:
                 continue
-            if not el.is_a("IfcSlab"):
-                continue
             color = rgb_color(r, g, b)
-            display.DisplayShape(geometry, color=color, transparency=abs(1 - a))
+            display.DisplayShape(geometry, color=color, transparency=abs(1 - a), update=False)
         except RuntimeError as e:
             print(f"Exception: name={el.Name}, exception={e}")
     display.FitAll()
+    display.Repaint()
 
     if use_storeys:
         for el in model.by_type("IfcBuildingStorey"):
@@ -61,6 +59,7 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("root")
     parser.add_argument("--use-storeys", action="store_true", help="pre-fill floors using IfcBuildingStorey elements")
+    parser.add_argument("--cache-dir", help="directory to cache shapes between runs")
     args = parser.parse_args()
 
     root_path = Path(args.root)
@@ -86,7 +85,7 @@ def main():
     def set_selected_ifc(ifc_file, _: None):
         nonlocal selected_ifc_file
         selected_ifc_file = ifc_file
-        load_ifc(selected_ifc_file, args.use_storeys)
+        load_ifc(selected_ifc_file, args.use_storeys, cache_dir=args.cache_dir)
         main_window.setWindowTitle(f"BatchPlan ({Path(ifc_file).name})")
         update_text()
 
@@ -0,0 +1,29 @@
+import resource
+import sys
+
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+def to_megabytes(maxrss):
+    if sys.platform == "darwin":
+        return maxrss / (1024 * 1024)
+    return maxrss / 1024
+
+
+def get_peak_rss():
+    return to_megabytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+# current resident set size, falls back to the peak where /proc isn't available
+def get_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return get_peak_rss()
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+
+# limits the address space of this process and the processes it starts, allocations beyond it fail
+def limit_memory(max_memory):
+    limit = int(max_memory * 1024 * 1024)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
@@ -0,0 +1,92 @@
+import numpy as np
+
+# maximum number of (row, edge) pairs evaluated at once while filling a polygon
+MAX_BLOCK_SIZE = 1 << 22
+
+
+# returns (scale, x offset, y offset) which maps the bbox (xmin, ymin, xmax, ymax) into the
+# image by keeping the aspect ratio, y axis is flipped since image rows grow downwards
+def get_transform(bbox, width, height, margin=0.05):
+    xmin, ymin, xmax, ymax = bbox
+    dx = max(xmax - xmin, 1e-9)
+    dy = max(ymax - ymin, 1e-9)
+    scale = min(width / dx, height / dy) * (1 - 2 * margin)
+    x_offset = (width - dx * scale) / 2 - xmin * scale
+    y_offset = (height - dy * scale) / 2 + ymax * scale
+    return scale, x_offset, y_offset
+
+
+def to_pixels(points, transform):
+    scale, x_offset, y_offset = transform
+    pixels = np.empty_like(points, dtype=float)
+    pixels[:, 0] = points[:, 0] * scale + x_offset
+    pixels[:, 1] = y_offset - points[:, 1] * scale
+    return pixels
+
+
+def get_edges(rings):
+    edges = [np.concatenate([ring, np.roll(ring, -1, axis=0)], axis=1) for ring in rings if len(ring) >= 3]
+    if len(edges) == 0:
+        return np.empty((0, 4))
+    return np.concatenate(edges)
+
+
+# fills a polygon given by its rings (outer and inner boundaries in pixel coordinates) using the
+# even-odd rule, a pixel is filled when its center is inside the polygon
+def fill_polygon(image, rings, color):
+    edges = get_edges(rings)
+    if len(edges) == 0:
+        return
+    height, width = image.shape[:2]
+    x0, y0, x1, y1 = edges.T
+    lo = np.minimum(y0, y1)
+    hi = np.maximum(y0, y1)
+    # horizontal edges never cross a scanline
+    dy = np.where(hi > lo, y1 - y0, 1)
+
+    row_min = max(int(np.floor(lo.min())), 0)
+    row_max = min(int(np.ceil(hi.max())), height - 1)
+    col_min = min(max(int(np.floor(min(x0.min(), x1.min()))), 0), width)
+    col_max = min(max(int(np.ceil(max(x0.max(), x1.max()))) + 1, 0), width)
+    if row_min > row_max or col_min >= col_max:
+        return
+    block = max(1, MAX_BLOCK_SIZE // len(edges))
+    for start in range(row_min, row_max + 1, block):
+        rows = np.arange(start, min(start + block, row_max + 1))
+        ys = rows[:, None] + 0.5
+        crosses = (ys >= lo) & (ys < hi)
+        xs = np.where(crosses, x0 + (ys - y0) / dy * (x1 - x0), np.inf)
+        max_count = crosses.sum(axis=1).max()
+        if max_count == 0:
+            continue
+        xs = np.sort(xs, axis=1)[:, :max_count]
+
+        # crossings come in pairs, pixels between each pair are inside
+        starts = xs[:, 0::2]
+        ends = xs[:, 1::2]
+        valid = np.isfinite(ends)
+        starts = np.clip(np.ceil(starts[valid] - 0.5), col_min, col_max).astype(int) - col_min
+        ends = np.clip(np.ceil(ends[valid] - 0.5), col_min, col_max).astype(int) - col_min
+        span_rows = np.broadcast_to(np.arange(len(rows))[:, None], valid.shape)[valid]
+
+        # spans are marked with +1/-1 at their ends and accumulated along the rows
+        cols = col_max - col_min + 1
+        coverage = np.bincount(span_rows * cols + starts, minlength=len(rows) * cols)
+        coverage -= np.bincount(span_rows * cols + ends, minlength=len(rows) * cols)
+        mask = np.cumsum(coverage.reshape(len(rows), cols), axis=1)[:, :-1] > 0
+        image[rows[0] : rows[-1] + 1, col_min:col_max][mask] = color
+
+
+def rasterize(polygons, width, height, bbox=None, background=(255, 255, 255), margin=0.05):
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = background
+    if len(polygons) == 0:
+        return image
+
+    if bbox is None:
+        points = np.concatenate([ring for rings, _ in polygons for ring in rings])
+        bbox = (*points.min(axis=0), *points.max(axis=0))
+    transform = get_transform(bbox, width, height, margin=margin)
+    for rings, color in polygons:
+        fill_polygon(image, [to_pixels(ring, transform) for ring in rings], color)
+    return image
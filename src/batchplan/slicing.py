@@ -0,0 +1,205 @@
+import numpy as np
+from OCC.Core.BRep import BRep_Tool
+from OCC.Core.BRepBuilderAPI import BRepBuilderAPI_MakeFace, BRepBuilderAPI_MakePolygon
+from OCC.Core.gp import gp_Pnt
+from OCC.Core.ShapeFix import ShapeFix_Face
+from OCC.Core.TopLoc import TopLoc_Location
+from OCC.Extend.TopologyUtils import TopologyExplorer
+
+from .utils import mesh_shape
+
+# start and end vertices of the three edges of a triangle
+EDGE_STARTS = np.array([0, 1, 2])
+EDGE_ENDS = np.array([1, 2, 0])
+
+
+# triangulates the geometries once and returns all triangles in a (n, 3, 3) array together with the index of
+# the geometry each triangle belongs to
+def triangulate(geometries, deflection=0.01, angle=0.5):
+    triangles = []
+    owners = []
+    for i, geometry in enumerate(geometries):
+        mesh_shape(geometry, deflection=deflection, angle=angle)
+        for face in TopologyExplorer(geometry).faces():
+            location = TopLoc_Location()
+            triangulation = BRep_Tool.Triangulation(face, location)
+            if triangulation is None:
+                continue
+            trsf = location.Transformation()
+            nodes = []
+            for j in range(1, triangulation.NbNodes() + 1):
+                point = triangulation.Node(j).Transformed(trsf)
+                nodes.append((point.X(), point.Y(), point.Z()))
+            nodes = np.array(nodes)
+            indices = [triangulation.Triangle(j).Get() for j in range(1, triangulation.NbTriangles() + 1)]
+            if len(indices) == 0:
+                continue
+            triangles.append(nodes[np.array(indices) - 1])
+            owners.append(np.full(len(indices), i))
+    if len(triangles) == 0:
+        return np.empty((0, 3, 3)), np.empty(0, dtype=int)
+    return np.concatenate(triangles), np.concatenate(owners)
+
+
+# intersects triangles with the horizontal plane at z and returns (n, 2, 2) XY segments with their owners
+def slice_triangles(triangles, owners, z):
+    d = triangles[:, :, 2] - z
+    above = d >= 0
+    n_above = above.sum(axis=1)
+    mask = (n_above == 1) | (n_above == 2)
+    triangles, d, above, owners = triangles[mask], d[mask], above[mask], owners[mask]
+
+    crosses = above[:, EDGE_STARTS] != above[:, EDGE_ENDS]
+    # edges are always interpolated from the vertex below to the vertex above, so that the triangles sharing
+    # an edge find exactly the same point and segments can be joined
+    starts = np.where(above[:, EDGE_STARTS], EDGE_ENDS, EDGE_STARTS)
+    ends = np.where(above[:, EDGE_STARTS], EDGE_STARTS, EDGE_ENDS)
+    lo = np.take_along_axis(triangles, starts[:, :, None], axis=1)
+    hi = np.take_along_axis(triangles, ends[:, :, None], axis=1)
+    d_lo = np.take_along_axis(d, starts, axis=1)
+    d_hi = np.take_along_axis(d, ends, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = d_lo / (d_lo - d_hi)
+        points = lo[:, :, :2] + t[:, :, None] * (hi[:, :, :2] - lo[:, :, :2])
+
+    # every sliced triangle has exactly two crossing edges
+    order = np.argsort(~crosses, axis=1, kind="stable")[:, :2]
+    segments = np.take_along_axis(points, order[:, :, None], axis=1)
+    return segments, owners
+
+
+# joins segments sharing end points into closed rings, open chains are closed as well
+def join_segments(segments, tol=1e-7):
+    keys = [tuple(k) for k in np.round(segments.reshape(-1, 2) / tol).astype(np.int64)]
+    neighbours = {}
+    for i, key in enumerate(keys):
+        neighbours.setdefault(key, []).append(i)
+
+    visited = np.zeros(len(segments), dtype=bool)
+    rings = []
+    for first in range(len(segments)):
+        if visited[first]:
+            continue
+        visited[first] = True
+        ring = [segments[first, 0], segments[first, 1]]
+        start_key = keys[2 * first]
+        key = keys[2 * first + 1]
+        while key != start_key:
+            following = None
+            for j in neighbours[key]:
+                if not visited[j // 2]:
+                    following = j
+                    break
+            if following is None:
+                break
+            visited[following // 2] = True
+            # the other end of the following segment
+            other = following ^ 1
+            ring.append(segments[other // 2, other % 2])
+            key = keys[other]
+        if key == start_key:
+            ring.pop()
+        if len(ring) >= 3:
+            rings.append(np.array(ring))
+    return rings
+
+
+def get_ring_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+# even-odd test of (n, 2) points against a ring
+def contains_points(ring, points):
+    x0, y0 = ring[:, 0], ring[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    px, py = points[:, 0:1], points[:, 1:2]
+    crosses = (y0 > py) != (y1 > py)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xs = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+    return (crosses & (px < xs)).sum(axis=1) % 2 == 1
+
+
+# midpoints of the ring's segments are tested since its vertices may touch the outer ring
+def ring_contains(outer, ring):
+    if (ring.min(axis=0) < outer.min(axis=0)).any() or (ring.max(axis=0) > outer.max(axis=0)).any():
+        return False
+    midpoints = (ring + np.roll(ring, -1, axis=0)) / 2
+    return contains_points(outer, midpoints).mean() > 0.5
+
+
+# groups rings into (outer ring, holes) pairs like SectionsToFaces of the fixes module does with wires. Rings
+# are sorted by area, so the parent of a ring is the smallest larger ring containing it. Rings at odd depths
+# are holes of their parents and rings at even depths are outer rings, e.g. an island inside a hole.
+def nest_rings(rings):
+    order = np.argsort([abs(get_ring_area(ring)) for ring in rings], kind="stable")[::-1]
+    rings = [rings[i] for i in order]
+    depths = []
+    nested = {}
+    for j, ring in enumerate(rings):
+        parent = next((k for k in range(j - 1, -1, -1) if ring_contains(rings[k], ring)), None)
+        depths.append(0 if parent is None else depths[parent] + 1)
+        if depths[j] % 2 == 0:
+            nested[j] = (ring, [])
+        else:
+            nested[parent][1].append(ring)
+    return list(nested.values())
+
+
+def make_ring_wire(ring, z):
+    polygon = BRepBuilderAPI_MakePolygon()
+    for x, y in ring:
+        polygon.Add(gp_Pnt(float(x), float(y), z))
+    polygon.Close()
+    if not polygon.IsDone():
+        return None
+    return polygon.Wire()
+
+
+def make_ring_face(ring, z, holes=()):
+    wire = make_ring_wire(ring, z)
+    if wire is None:
+        return None
+    face = BRepBuilderAPI_MakeFace(wire, True)
+    if not face.IsDone():
+        return None
+    if len(holes) == 0:
+        return face.Face()
+    for hole in holes:
+        hole_wire = make_ring_wire(hole, z)
+        if hole_wire is not None:
+            face.Add(hole_wire)
+    # holes may run in the same direction as the outer ring, fixing the orientation reverses them
+    fix = ShapeFix_Face(face.Face())
+    fix.FixOrientation()
+    return fix.Face()
+
+
+# yields (index, faces) pairs level by level like extract_floor_plans.get_level_faces does, geometries are
+# triangulated only once and every level is found by slicing the triangles. Takes (section height, indices) pairs.
+def iter_mesh_level_faces(levels, geometries, deflection=0.01):
+    needed = sorted(set(i for _, indices in levels for i in indices))
+    triangles, owners = triangulate([geometries[i] for i in needed], deflection=deflection)
+    owners = np.asarray(needed, dtype=int)[owners]
+    for section_height, indices in levels:
+        yield get_mesh_level_faces(triangles, owners, section_height, indices)
+
+
+# returns (index, faces) pairs for the given geometry indices, rings inside other rings of the same geometry
+# become holes
+def get_mesh_level_faces(triangles, owners, z, indices):
+    segments, segment_owners = slice_triangles(triangles, owners, z)
+    order = np.argsort(segment_owners, kind="stable")
+    segments, segment_owners = segments[order], segment_owners[order]
+    starts = np.searchsorted(segment_owners, indices, side="left")
+    ends = np.searchsorted(segment_owners, indices, side="right")
+
+    level_faces = []
+    for i, start, end in zip(indices, starts, ends):
+        faces = []
+        for ring, holes in nest_rings(join_segments(segments[start:end])):
+            face = make_ring_face(ring, z, holes)
+            if face is not None:
+                faces.append(face)
+        level_faces.append((i, faces))
+    return level_faces
@@ -1,7 +1,10 @@
+import functools
+import zlib
+
 import matplotlib.colors as mcolors
 import pandas as pd
 
-from .utils import get_name
+from .utils import get_name_of
 
 
 def all_black():
@@ -17,7 +20,8 @@ def hash_color():
 
     def fn(el, sh):
         type = el.is_a()
-        h = hash(type)
+        # hash() of strings is salted per process, crc32 gives the same color in every run
+        h = zlib.crc32(type.encode())
         k = color_names[h % len(cmap)]
         return mcolors.to_rgba(cmap[k]), True
 
@@ -29,8 +33,10 @@ NAME_COL = "Product Name"
 SCORE_COL = "Element Environmental Score"
 
 
-def carbon_color():
-    df = pd.read_csv("totem_mapping_materials_assigned.csv")
+# scores are looked up in a name -> color dict built once, and names are memoized per element name since
+# elements are colored again for the overview and for every level
+def carbon_color(mapping_path="totem_mapping_materials_assigned.csv"):
+    df = pd.read_csv(mapping_path)
     cols = [REF_COL, NAME_COL]
     df[cols] = df[cols].ffill()
     df = df[df["Selected"] == 1]
@@ -39,17 +45,21 @@ def carbon_color():
     df[SCORE_COL] = scores
     # cmap = matplotlib.colormaps["RdYlGn"]
     cmap = mcolors.LinearSegmentedColormap.from_list("gyr", ["g", "y", "r"], N=1024)
+    # the first score of a name is used if it appears more than once
+    df = df.drop_duplicates(NAME_COL)
+    colors = {name: cmap(score) for name, score in zip(df[NAME_COL], df[SCORE_COL])}
+    default_color = cmap(0.5)
+
+    @functools.lru_cache(maxsize=1 << 16)
+    def lookup(element_name, element_type):
+        name = get_name_of(element_name)
+        color = colors.get(name)
+        if color is None:
+            print(f"Warning: No associated score for: Type: {element_type}, Name: {name}")
+            return default_color, False
+        return color, True
 
     def fn(el, sh):
-        name = get_name(el)
-        df2 = df[df[NAME_COL] == name]
-        if len(df2) == 0:
-            print(f"Warning: No associated score for: Type: {el.is_a()}, Name: {name}")
-            score = 0.5
-            found = False
-        else:
-            score = df2[SCORE_COL].tolist()[0]
-            found = True
-        return cmap(score), found
+        return lookup(el.Name, el.is_a())
 
     return fn
@@ -1,46 +1,231 @@
+import json
 import re
+from collections import namedtuple
 
 import ifcopenshell
 import ifcopenshell.geom
+import numpy as np
+import shapely
+from ifcopenshell.util.element import get_material
+from ifcopenshell.util.placement import get_local_placement
 from ifcopenshell.util.selector import filter_elements
+from ifcopenshell.util.unit import calculate_unit_scale
 from OCC.Core.Bnd import Bnd_Box
+from OCC.Core.BRep import BRep_Builder, BRep_Tool
+from OCC.Core.BRepAdaptor import BRepAdaptor_Curve
 from OCC.Core.BRepBndLib import brepbndlib
 from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
+from OCC.Core.BRepTools import BRepTools_ShapeSet, breptools
+from OCC.Core.GCPnts import GCPnts_TangentialDeflection
+from OCC.Core.GeomAbs import GeomAbs_Line
+from OCC.Core.gp import gp_Trsf
+from OCC.Core.TopAbs import TopAbs_FORWARD, TopAbs_REVERSED
+from OCC.Core.TopLoc import TopLoc_Location
+from OCC.Core.TopoDS import TopoDS_Compound, TopoDS_Iterator
+from OCC.Extend.TopologyUtils import TopologyExplorer, WireExplorer
 
+from .instrumentation import count, stage, time_element
 
-def get_elements_and_shapes(model, filter_fn=None, filter=None):
+# shape of an element placed as an instance of another element's shape
+InstanceShape = namedtuple("InstanceShape", ("data", "geometry", "styles", "instance"))
+
+# geometry settings used for every shape, also a part of the shape cache key
+GEOMETRY_SETTINGS = {"USE_PYTHON_OPENCASCADE": True}
+
+
+def get_settings():
     settings = ifcopenshell.geom.settings()
-    settings.set(settings.USE_PYTHON_OPENCASCADE, True)
+    for name, value in GEOMETRY_SETTINGS.items():
+        settings.set(getattr(settings, name), value)
+    return settings
 
+
+def get_elements(model, filter_fn=None, filter=None):
     rest = model
     if filter is not None and not isinstance(model, list):
         rest = filter_elements(model, filter)
 
-    def cs(el):
+    if filter_fn is not None:
+        return [el for el in rest if filter_fn(el)]
+    return list(rest)
+
+
+def get_elements_and_shapes(model, filter_fn=None, filter=None, geom_threads=1, cache=None, instancing=False):
+    settings = get_settings()
+    rest = get_elements(model, filter_fn=filter_fn, filter=filter)
+
+    created = {}
+    missing = rest
+    # failures are cached per method of creating shapes
+    method = "iterator" if geom_threads > 1 else "create_shape"
+    if cache is not None:
+        missing = []
+        # cached shapes don't keep their instance, so elements which may be instanced bypass the cache and share
+        # their prototype's shape and sections instead
+        bypassed = {el.id() for el in rest if get_mapped_item_key(el) is not None} if instancing else set()
+        with stage("cache_read"):
+            for el in rest:
+                if el.id() in bypassed:
+                    missing.append(el)
+                    continue
+                found, shape = cache.get(el, method)
+                if found:
+                    created[el.id()] = shape
+                else:
+                    missing.append(el)
+
+    with stage("create_shapes"):
+        if instancing:
+            created.update(create_instanced_shapes(settings, missing, geom_threads))
+        else:
+            created.update(create_shapes(settings, missing, geom_threads))
+
+    if cache is not None:
+        with stage("cache_write"):
+            for el in missing:
+                if el.id() in bypassed:
+                    continue
+                shape = created.get(el.id())
+                if shape is None:
+                    cache.put_failure(el, method)
+                else:
+                    cache.put(el, shape)
+
+    elements = []
+    shapes = []
+    for el in rest:
+        shape = created.get(el.id())
+        if shape is not None:
+            elements.append(el)
+            shapes.append(shape)
+    count("shapes", len(shapes))
+    return elements, shapes
+
+
+def create_shapes(settings, elements, geom_threads=1):
+    if geom_threads > 1 and len(elements) > 0:
+        return create_shapes_with_iterator(settings, elements, geom_threads)
+    created = {}
+    for el in elements:
         try:
-            shape = ifcopenshell.geom.create_shape(settings, el)
-            return shape
+            with time_element("create_shape", el):
+                created[el.id()] = ifcopenshell.geom.create_shape(settings, el)
         except RuntimeError as e:
+            count("shape_failures")
             print(f"Shape could not created for: type={el.is_a()}, name={el.Name}, exception={e}")
-            return None
+    return created
 
-    elements = []
-    shapes = []
-    if filter_fn is not None:
+
+# returns a key shared by elements whose body is the same mapped representation placed with equal mapping
+# targets and styled the same way, so that their shapes only differ by their placements. Styles of an element
+# come from its own material when the mapped items aren't styled, so elements are grouped by their materials and
+# the styles of their mapped items as well. Elements with openings or projections are excluded since those change
+# their shapes.
+def get_mapped_item_key(element):
+    if element.Representation is None:
+        return None
+    if len(getattr(element, "HasOpenings", None) or ()) > 0 or len(getattr(element, "HasProjections", None) or ()) > 0:
+        return None
+    bodies = [r for r in element.Representation.Representations if r.RepresentationIdentifier == "Body"]
+    if len(bodies) != 1 or len(bodies[0].Items) != 1:
+        return None
+    item = bodies[0].Items[0]
+    if not item.is_a("IfcMappedItem"):
+        return None
+    # exporters often write an equal mapping target for every instance, so targets are compared by value
+    target = item.MappingTarget.get_info(include_identifier=False, recursive=True)
+    material = get_material(element)
+    styles = sorted(styled.id() for styled in getattr(item, "StyledByItem", None) or ())
+    return (
+        item.MappingSource.id(),
+        json.dumps(target, sort_keys=True, default=str),
+        None if material is None else material.id(),
+        tuple(styles),
+    )
+
+
+# returns the transformation moving the prototype's shape onto the element's shape in meters, or None if it
+# isn't rigid (mirrored or scaled placements)
+def get_instance_matrix(element, prototype, unit_scale):
+    matrix = get_local_placement(element.ObjectPlacement) @ np.linalg.inv(
+        get_local_placement(prototype.ObjectPlacement)
+    )
+    rotation = matrix[:3, :3]
+    if not np.allclose(rotation @ rotation.T, np.eye(3), atol=1e-9) or np.linalg.det(rotation) < 0:
+        return None
+    matrix[:3, 3] *= unit_scale
+    return matrix
+
+
+def get_location(matrix):
+    trsf = gp_Trsf()
+    trsf.SetValues(*(float(v) for v in matrix[:3].ravel()))
+    return TopLoc_Location(trsf)
+
+
+# builds shapes of elements sharing a mapped representation once, the first element of a group is the prototype
+# and the rest are its shape moved by their placements, so they share the same BRep in memory. Shapes of grouped
+# elements keep (group key, matrix relative to the prototype) as instance to let sections be reused as well.
+def create_instanced_shapes(settings, elements, geom_threads=1):
+    groups = {}
+    singles = []
+    for el in elements:
+        key = get_mapped_item_key(el)
+        if key is None:
+            singles.append(el)
+        else:
+            groups.setdefault(key, []).append(el)
+    prototypes = []
+    for key, group in list(groups.items()):
+        if len(group) == 1:
+            singles.extend(group)
+            del groups[key]
+        else:
+            prototypes.append(group[0])
+
+    created = create_shapes(settings, singles + prototypes, geom_threads)
+    if len(groups) == 0:
+        return created
+
+    unit_scale = calculate_unit_scale(ifcopenshell.file.from_pointer(elements[0].wrapped_data.file_pointer()))
+    fallback = []
+    for key, (prototype, *rest) in groups.items():
+        shape = created.get(prototype.id())
+        if shape is None:
+            fallback.extend(rest)
+            continue
+        created[prototype.id()] = InstanceShape(shape.data, shape.geometry, shape.styles, (key, np.eye(4)))
         for el in rest:
-            if not filter_fn(el):
+            matrix = get_instance_matrix(el, prototype, unit_scale)
+            if matrix is None:
+                fallback.append(el)
                 continue
-            shape = cs(el)
-            if shape is not None:
-                elements.append(el)
-                shapes.append(shape)
-    else:
-        for el in rest:
-            shape = cs(el)
-            if shape is not None:
-                elements.append(el)
-                shapes.append(shape)
-    return elements, shapes
+            geometry = shape.geometry.Moved(get_location(matrix))
+            created[el.id()] = InstanceShape(None, geometry, shape.styles, (key, matrix))
+            count("instances")
+    created.update(create_shapes(settings, fallback, geom_threads))
+    return created
+
+
+# builds shapes of the given elements using ifcopenshell's multi-threaded geometry iterator
+def create_shapes_with_iterator(settings, elements, num_threads):
+    model = ifcopenshell.file.from_pointer(elements[0].wrapped_data.file_pointer())
+    iterator = ifcopenshell.geom.iterator(settings, model, num_threads, include=elements)
+
+    created = {}
+    if iterator.initialize():
+        while True:
+            shape = iterator.get()
+            created[shape.data.id] = shape
+            if not iterator.next():
+                break
+
+    # the iterator silently skips elements it fails on, report them like create_shape does
+    for el in elements:
+        if el.id() not in created:
+            count("shape_failures")
+            print(f"Shape could not created for: type={el.is_a()}, name={el.Name}, exception=skipped by iterator")
+    return created
 
 
 def get_geometries(shapes):
@@ -53,21 +238,177 @@ def get_bounding_box(shapes, tol=1e-6, use_mesh=False):
     bbox.SetGap(tol)
     for shape in shapes:
         if use_mesh:
-            mesh = BRepMesh_IncrementalMesh()
-            mesh.SetParallelDefault(True)
-            mesh.SetShape(shape)
-            mesh.Perform()
-            if not mesh.IsDone():
-                raise AssertionError("Mesh not done.")
+            mesh_shape(shape)
         brepbndlib.Add(shape, bbox, use_mesh)
     return bbox.Get()
 
 
+def mesh_shape(shape, deflection=0.001, angle=0.5):
+    mesh = BRepMesh_IncrementalMesh(shape, deflection, False, angle, True)
+    if not mesh.IsDone():
+        raise AssertionError("Mesh not done.")
+
+
+def get_wire_points(wire):
+    points = [BRep_Tool.Pnt(vertex) for vertex in WireExplorer(wire).ordered_vertices()]
+    return np.array([(point.X(), point.Y()) for point in points], dtype=float).reshape(-1, 2)
+
+
+# returns XY coordinates of the outer wire of a face followed by its inner wires, only vertices are used unless
+# a discretizer is given
+def get_face_rings(face, discretizer=None):
+    get_points = get_wire_points if discretizer is None else discretizer.get_wire_points
+    outer_wire = breptools.OuterWire(face)
+    rings = [get_points(outer_wire)]
+    for wire in TopologyExplorer(face).wires():
+        if not wire.IsSame(outer_wire):
+            rings.append(get_points(wire))
+    return rings
+
+
+# discretizes wires into XY polylines. Straight edges are represented by their end points, other edges are
+# sampled adaptively so that neither the sagitta exceeds deflection nor the turning angle exceeds angle between
+# consecutive points. Adjacent faces and all formatters of a level share edges, so polylines are cached per edge.
+class Discretizer:
+    def __init__(self, deflection=0.005, angle=0.2, max_edges=100000):
+        self.deflection = deflection
+        self.angle = angle
+        self.max_edges = max_edges
+        self.edges = {}
+
+    # returns the points of the edge in the direction of its curve's parameter
+    def get_edge_points(self, edge):
+        key = edge.Oriented(TopAbs_FORWARD)
+        points = self.edges.get(key)
+        if points is not None:
+            return points
+
+        curve = BRepAdaptor_Curve(edge)
+        if curve.GetType() == GeomAbs_Line:
+            pnts = [curve.Value(curve.FirstParameter()), curve.Value(curve.LastParameter())]
+        else:
+            sampler = GCPnts_TangentialDeflection(curve, self.angle, self.deflection)
+            pnts = [sampler.Value(i) for i in range(1, sampler.NbPoints() + 1)]
+        points = np.array([(pnt.X(), pnt.Y()) for pnt in pnts], dtype=float).reshape(-1, 2)
+
+        # the cache is dropped as a whole when it's full, edges are mostly reused within a level anyway
+        if len(self.edges) >= self.max_edges:
+            self.edges.clear()
+        self.edges[key] = points
+        return points
+
+    def get_wire_points(self, wire):
+        polylines = []
+        for edge in WireExplorer(wire).ordered_edges():
+            if BRep_Tool.Degenerated(edge):
+                continue
+            points = self.get_edge_points(edge)
+            if edge.Orientation() == TopAbs_REVERSED:
+                points = points[::-1]
+            # follows the previous polyline even if the orientation of an edge is inconsistent
+            if len(polylines) > 0:
+                end = polylines[-1][-1]
+                if np.sum((points[-1] - end) ** 2) < np.sum((points[0] - end) ** 2):
+                    points = points[::-1]
+            # the last point of every edge is the first point of the next one
+            polylines.append(points[:-1])
+        if len(polylines) == 0:
+            return np.empty((0, 2))
+        return np.concatenate(polylines)
+
+
+# builds a MultiPolygon per element from the rings of its faces with Shapely's vectorized constructors, so that
+# coordinates are gathered into flat arrays once instead of creating a Shapely object per ring. Elements without
+# a valid face get None.
+def get_multipolygons(shape_faces, discretizer=None):
+    coords = []
+    ring_indices = []
+    polygon_indices = []
+    owners = []
+    for i, faces in enumerate(shape_faces):
+        for face in faces:
+            outer_ring, *inner_rings = get_face_rings(face, discretizer)
+            if len(outer_ring) < 3:
+                continue
+            rings = [outer_ring] + [ring for ring in inner_rings if len(ring) >= 3]
+            for ring in rings:
+                ring_indices.append(np.full(len(ring), len(coords)))
+                coords.append(ring)
+            polygon_indices.append(np.full(len(rings), len(owners)))
+            owners.append(i)
+
+    multipolygons = np.full(len(shape_faces), None, dtype=object)
+    if len(owners) == 0:
+        return multipolygons
+    rings = shapely.linearrings(np.concatenate(coords), indices=np.concatenate(ring_indices))
+    polygons = shapely.polygons(rings, indices=np.concatenate(polygon_indices))
+    return shapely.multipolygons(polygons, indices=owners, out=multipolygons)
+
+
+def make_compound(shapes):
+    compound = TopoDS_Compound()
+    builder = BRep_Builder()
+    builder.MakeCompound(compound)
+    for shape in shapes:
+        builder.Add(compound, shape)
+    return compound
+
+
+# serializes shapes as BRep text, shapes are wrapped in a compound so that their locations are kept
+def dump_shapes(shapes):
+    shape_set = BRepTools_ShapeSet()
+    shape_set.Add(make_compound(shapes))
+    return shape_set.WriteToString()
+
+
+def load_shapes(data):
+    shape_set = BRepTools_ShapeSet()
+    shape_set.ReadFromString(data)
+    return list(iter_compound(shape_set.Shape(shape_set.NbShapes())))
+
+
+# yields direct children of a compound, unlike TopologyExplorer it doesn't look for duplicates
+def iter_compound(compound):
+    iterator = TopoDS_Iterator(compound)
+    while iterator.More():
+        yield iterator.Value()
+        iterator.Next()
+
+
+def get_z_extents(shapes):
+    extents = []
+    for shape in shapes:
+        bbox = get_bounding_box([shape.geometry])
+        extents.append((bbox[2], bbox[5]))
+    return extents
+
+
+# keeps elements' Z extents sorted by their lower ends so that the elements
+# cut by a horizontal plane can be found without touching the rest
+class ZIntervalIndex:
+    def __init__(self, extents):
+        extents = np.asarray(extents, dtype=float).reshape(-1, 2)
+        self.order = np.argsort(extents[:, 0], kind="stable")
+        self.zmins = extents[self.order, 0]
+        self.zmaxs = extents[self.order, 1]
+
+    def __len__(self):
+        return len(self.order)
+
+    def query(self, z):
+        end = np.searchsorted(self.zmins, z, side="right")
+        hits = self.order[:end][self.zmaxs[:end] >= z]
+        return np.sort(hits).tolist()
+
+
 # tries to extract some meaningful name from KAAN projects
 def get_name(element):
-    name = element.Name
-    if ":" in element.Name:
-        name = ":".join(element.Name.split(":")[:2])
+    return get_name_of(element.Name)
+
+
+def get_name_of(name):
+    if ":" in name:
+        name = ":".join(name.split(":")[:2])
     matches = re.findall("(.*)_|\s+[0-9]+ ?mm", name)
     if len(matches) > 0:
         name = matches[0]
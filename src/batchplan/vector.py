@@ -0,0 +1,137 @@
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+# drawings are written at 1:100, coordinates of IFC models are in meters
+PLAN_SCALE = 100
+POINTS_PER_MM = 72 / 25.4
+# the largest page size most PDF readers support
+MAX_PDF_POINTS = 14400
+
+
+def format_numbers(values, precision):
+    return np.char.mod(f"%.{precision}f", values)
+
+
+def get_margin(bbox, margin=0.05):
+    xmin, ymin, xmax, ymax = bbox
+    d = max(xmax - xmin, ymax - ymin, 1e-9) * margin
+    return xmin - d, ymin - d, xmax + d, ymax + d
+
+
+# writes paths into an SVG file as they come, so that only one element's rings are in memory at a time. Y is
+# flipped since SVG's Y axis points downwards, coordinates are in meters and the document's size is at PLAN_SCALE.
+class SVGWriter:
+    def __init__(self, f, bbox, precision=3):
+        self.f = f
+        self.precision = precision
+        xmin, ymin, xmax, ymax = get_margin(bbox)
+        width, height = xmax - xmin, ymax - ymin
+        mm = 1000 / PLAN_SCALE
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width * mm:.3f}mm" height="{height * mm:.3f}mm" '
+            f'viewBox="{xmin:.3f} {-ymax:.3f} {width:.3f} {height:.3f}" fill-rule="evenodd">\n'
+        )
+
+    def begin_group(self, name):
+        self.f.write(f"<g id={quoteattr(name)}>\n")
+
+    def end_group(self):
+        self.f.write("</g>\n")
+
+    def write_path(self, rings, color, global_id, name=None):
+        subpaths = []
+        for ring in rings:
+            if len(ring) < 3:
+                continue
+            points = format_numbers(ring * (1, -1), self.precision)
+            coordinates = " ".join(" ".join(point) for point in points[1:])
+            subpaths.append(f"M{points[0][0]} {points[0][1]} L{coordinates}Z")
+        if len(subpaths) == 0:
+            return
+        # alpha is ignored, paths are filled opaque like the raster formatters paint faces
+        r, g, b, _ = color
+        fill = "#{:02x}{:02x}{:02x}".format(*(int(round(c * 255)) for c in (r, g, b)))
+        attributes = f"data-globalid={quoteattr(global_id)}"
+        if name is not None:
+            attributes += f" data-name={quoteattr(name)}"
+        self.f.write(f'<path {attributes} fill="{fill}" d="{"".join(subpaths)}"/>\n')
+
+    def close(self):
+        self.f.write("</svg>\n")
+
+
+def encode_pdf_text(text):
+    return "<FEFF" + text.encode("utf-16-be").hex().upper() + ">"
+
+
+# writes a single page PDF by hand. The content stream is written as paths come and its length, the (empty)
+# resources and the cross-reference table are written after it, so the page never has to be kept in memory. IFC
+# types are marked content sequences and elements are marked with their GlobalId and name.
+class PDFWriter:
+    def __init__(self, f, bbox, precision=4):
+        self.f = f
+        self.precision = precision
+        self.offsets = {}
+        xmin, ymin, xmax, ymax = get_margin(bbox)
+        scale = 1000 / PLAN_SCALE * POINTS_PER_MM
+        scale = min(scale, MAX_PDF_POINTS / max(xmax - xmin, ymax - ymin, 1e-9))
+        width, height = (xmax - xmin) * scale, (ymax - ymin) * scale
+
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self.write_object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+        self.write_object(2, "<< /Type /Pages /Kids [3 0 R] /Count 1 >>")
+        self.write_object(
+            3,
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:.2f} {height:.2f}] /Resources 5 0 R "
+            "/Contents 4 0 R >>",
+        )
+        self.offsets[4] = f.tell()
+        f.write(b"4 0 obj\n<< /Length 6 0 R >>\nstream\n")
+        self.stream_start = f.tell()
+        self.write(f"{scale:.6f} 0 0 {scale:.6f} {-xmin * scale:.4f} {-ymin * scale:.4f} cm\n")
+
+    def write(self, text):
+        self.f.write(text.encode("ascii"))
+
+    def write_object(self, number, body):
+        self.offsets[number] = self.f.tell()
+        self.write(f"{number} 0 obj\n{body}\nendobj\n")
+
+    def begin_group(self, name):
+        self.write(f"/{name} BMC\n")
+
+    def end_group(self):
+        self.write("EMC\n")
+
+    def write_path(self, rings, color, global_id, name=None):
+        commands = []
+        for ring in rings:
+            if len(ring) < 3:
+                continue
+            points = format_numbers(ring, self.precision)
+            commands.append(f"{points[0][0]} {points[0][1]} m\n")
+            commands.extend(f"{x} {y} l\n" for x, y in points[1:])
+            commands.append("h\n")
+        if len(commands) == 0:
+            return
+        # alpha is ignored, paths are filled opaque like the raster formatters paint faces
+        r, g, b, _ = color
+        properties = f"/GlobalId {encode_pdf_text(global_id)}"
+        if name is not None:
+            properties += f" /Name {encode_pdf_text(name)}"
+        self.write(f"/Element << {properties} >> BDC\n{r:.3f} {g:.3f} {b:.3f} rg\n")
+        self.write("".join(commands))
+        self.write("f*\nEMC\n")
+
+    def close(self):
+        length = self.f.tell() - self.stream_start
+        self.write("\nendstream\nendobj\n")
+        self.write_object(5, "<< >>")
+        self.write_object(6, str(length))
+        xref = self.f.tell()
+        self.write(f"xref\n0 {len(self.offsets) + 1}\n0000000000 65535 f \n")
+        for number in sorted(self.offsets):
+            self.write(f"{self.offsets[number]:010d} 00000 n \n")
+        self.write(f"trailer\n<< /Size {len(self.offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n")
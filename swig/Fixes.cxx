@@ -23,6 +23,32 @@
 // #include <ShapeAnalysis_WireOrder.hxx>
 // #include <ShapeAnalysis_WireVertex.hxx>
 
+#include <BRepAdaptor_Curve.hxx>
+#include <BRepAlgoAPI_Section.hxx>
+#include <BRepBndLib.hxx>
+#include <BRepBuilderAPI_MakeFace.hxx>
+#include <BRepClass_FaceClassifier.hxx>
+#include <BRepGProp.hxx>
+#include <BRep_Builder.hxx>
+#include <Bnd_Box.hxx>
+#include <GProp_GProps.hxx>
+#include <ShapeFix_Face.hxx>
+#include <Standard_Failure.hxx>
+#include <TopExp.hxx>
+#include <TopExp_Explorer.hxx>
+#include <TopTools_IndexedMapOfShape.hxx>
+#include <TopoDS.hxx>
+#include <TopoDS_Compound.hxx>
+#include <TopoDS_Face.hxx>
+#include <TopoDS_Wire.hxx>
+#include <gp_Dir.hxx>
+#include <gp_Pln.hxx>
+#include <gp_Pnt.hxx>
+
+#include <algorithm>
+#include <cmath>
+#include <vector>
+
 #include "Fixes.hxx"
 
 opencascade::handle<TopTools_HSequenceOfShape>
@@ -31,4 +57,163 @@ ConnectEdgesToWiresFixed(opencascade::handle<TopTools_HSequenceOfShape> &edges,
   auto wires = opencascade::handle<TopTools_HSequenceOfShape>();
   ShapeAnalysis_FreeBounds::ConnectEdgesToWires(edges, toler, shared, wires);
   return wires;
-}
\ No newline at end of file
+}
+
+namespace {
+
+struct Loop {
+  TopoDS_Wire wire;
+  TopoDS_Face face;
+  double xmin, ymin, xmax, ymax;
+  double area;
+  int parent;
+  int depth;
+};
+
+bool BoxContains(const Loop &outer, const Loop &inner, const double toler) {
+  return outer.xmin - toler <= inner.xmin && inner.xmax <= outer.xmax + toler &&
+         outer.ymin - toler <= inner.ymin && inner.ymax <= outer.ymax + toler;
+}
+
+// Classifies midpoints of the inner loop's edges against the outer loop's
+// face. Loops of touching parts may share vertices and edges, so midpoints on
+// the outer loop are skipped and the first one inside or outside decides.
+bool Contains(const Loop &outer, const Loop &inner, const double toler) {
+  if (!BoxContains(outer, inner, toler)) {
+    return false;
+  }
+  for (TopExp_Explorer it(inner.wire, TopAbs_EDGE); it.More(); it.Next()) {
+    BRepAdaptor_Curve curve(TopoDS::Edge(it.Current()));
+    gp_Pnt point =
+        curve.Value((curve.FirstParameter() + curve.LastParameter()) / 2);
+    BRepClass_FaceClassifier classifier(outer.face, point, toler);
+    TopAbs_State state = classifier.State();
+    if (state == TopAbs_IN) {
+      return true;
+    }
+    if (state == TopAbs_OUT) {
+      return false;
+    }
+  }
+  return false;
+}
+
+TopoDS_Compound SectionToFaces(const TopoDS_Shape &section, const double toler,
+                               const bool shared) {
+  BRep_Builder builder;
+  TopoDS_Compound compound;
+  builder.MakeCompound(compound);
+
+  TopTools_IndexedMapOfShape edge_map;
+  TopExp::MapShapes(section, TopAbs_EDGE, edge_map);
+  if (edge_map.IsEmpty()) {
+    return compound;
+  }
+  auto edges = opencascade::handle<TopTools_HSequenceOfShape>(
+      new TopTools_HSequenceOfShape());
+  for (int i = 1; i <= edge_map.Extent(); i++) {
+    edges->Append(edge_map(i));
+  }
+  auto wires = ConnectEdgesToWiresFixed(edges, toler, shared);
+
+  std::vector<Loop> loops;
+  for (int i = 1; i <= wires->Length(); i++) {
+    TopoDS_Wire wire = TopoDS::Wire(wires->Value(i));
+    BRepBuilderAPI_MakeFace maker(wire, Standard_True);
+    if (!maker.IsDone()) {
+      continue;
+    }
+    Loop loop;
+    loop.wire = wire;
+    loop.face = maker.Face();
+    Bnd_Box box;
+    BRepBndLib::Add(wire, box);
+    double zmin, zmax;
+    box.Get(loop.xmin, loop.ymin, zmin, loop.xmax, loop.ymax, zmax);
+    GProp_GProps props;
+    BRepGProp::SurfaceProperties(loop.face, props);
+    loop.area = std::fabs(props.Mass());
+    loop.parent = -1;
+    loop.depth = 0;
+    loops.push_back(loop);
+  }
+
+  // a loop can only be inside a larger one, so the parent of a loop is the
+  // first containing loop when the larger loops are visited smallest first
+  std::stable_sort(loops.begin(), loops.end(), [](const Loop &a, const Loop &b) {
+    return a.area > b.area;
+  });
+  for (int i = 0; i < static_cast<int>(loops.size()); i++) {
+    for (int j = i - 1; j >= 0; j--) {
+      if (Contains(loops[j], loops[i], toler)) {
+        loops[i].parent = j;
+        loops[i].depth = loops[j].depth + 1;
+        break;
+      }
+    }
+  }
+
+  for (int i = 0; i < static_cast<int>(loops.size()); i++) {
+    if (loops[i].depth % 2 == 1) {
+      continue;
+    }
+    BRepBuilderAPI_MakeFace maker(loops[i].face);
+    bool has_holes = false;
+    for (int j = i + 1; j < static_cast<int>(loops.size()); j++) {
+      if (loops[j].parent == i && loops[j].depth % 2 == 1) {
+        maker.Add(loops[j].wire);
+        has_holes = true;
+      }
+    }
+    TopoDS_Face face = maker.Face();
+    if (has_holes) {
+      // holes keep the orientation they were connected with, so wires are
+      // oriented to bound the material
+      ShapeFix_Face fix(face);
+      fix.FixOrientation();
+      face = fix.Face();
+    }
+    builder.Add(compound, face);
+  }
+  return compound;
+}
+
+} // namespace
+
+opencascade::handle<TopTools_HSequenceOfShape>
+SectionsToFaces(opencascade::handle<TopTools_HSequenceOfShape> &sections,
+                const double toler, const bool shared) {
+  auto faces = opencascade::handle<TopTools_HSequenceOfShape>(
+      new TopTools_HSequenceOfShape());
+  for (int i = 1; i <= sections->Length(); i++) {
+    faces->Append(SectionToFaces(sections->Value(i), toler, shared));
+  }
+  return faces;
+}
+
+opencascade::handle<TopTools_HSequenceOfShape>
+SectionShapesToFaces(opencascade::handle<TopTools_HSequenceOfShape> &shapes,
+                     const double height, const double toler,
+                     const bool shared, const bool run_parallel) {
+  gp_Pln plane(gp_Pnt(0, 0, height), gp_Dir(0, 0, 1));
+  auto faces = opencascade::handle<TopTools_HSequenceOfShape>(
+      new TopTools_HSequenceOfShape());
+  for (int i = 1; i <= shapes->Length(); i++) {
+    // stays null if sectioning or making faces fails, an empty compound
+    // means the shape isn't cut by the plane
+    TopoDS_Shape compound;
+    try {
+      BRepAlgoAPI_Section section(shapes->Value(i), plane, Standard_False);
+      section.SetRunParallel(run_parallel);
+      section.SetNonDestructive(Standard_True);
+      section.Build();
+      if (section.IsDone()) {
+        compound = SectionToFaces(section.Shape(), toler, shared);
+      }
+    } catch (Standard_Failure &) {
+      compound.Nullify();
+    }
+    faces->Append(compound);
+  }
+  return faces;
+}
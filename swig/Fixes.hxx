@@ -32,4 +32,22 @@ extern "C" {
 opencascade::handle<TopTools_HSequenceOfShape>
 ConnectEdgesToWiresFixed(opencascade::handle<TopTools_HSequenceOfShape> &edges,
                          const double toler, const bool shared);
+
+// Turns section results (shapes whose edges are sections of an element) into
+// planar faces in one call. The i-th item of the returned sequence is a
+// compound of the faces of the i-th section. Wires inside an odd number of
+// other wires are added as holes to the smallest wire containing them.
+opencascade::handle<TopTools_HSequenceOfShape>
+SectionsToFaces(opencascade::handle<TopTools_HSequenceOfShape> &sections,
+                const double toler, const bool shared);
+
+// Sections every shape with the horizontal plane at the given height and
+// turns the sections into faces like SectionsToFaces. Shapes are sectioned in
+// non-destructive mode, so threads can section shared shapes at the same
+// time. Shapes whose section fails get a null shape, shapes not cut by the
+// plane get an empty compound.
+opencascade::handle<TopTools_HSequenceOfShape>
+SectionShapesToFaces(opencascade::handle<TopTools_HSequenceOfShape> &shapes,
+                     const double height, const double toler,
+                     const bool shared, const bool run_parallel);
 }
\ No newline at end of file
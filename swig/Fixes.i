@@ -1,6 +1,9 @@
 %module fixes
 
 %{
+#include <string>
+
+#include <Standard_Failure.hxx>
 #include <TopTools_HSequenceOfShape.hxx>
 #include "Fixes.hxx"
 %}
@@ -9,4 +12,33 @@
 
 %wrap_handle(TopTools_HSequenceOfShape)
 
+// the GIL is released while OCC runs so that threads can section in parallel,
+// OCC exceptions are caught before the GIL is taken back
+%define RELEASE_GIL(NAME)
+%exception NAME {
+  {
+    const char *error = NULL;
+    std::string message;
+    Py_BEGIN_ALLOW_THREADS
+    try {
+      $action
+    } catch (Standard_Failure &e) {
+      message = e.GetMessageString();
+      error = message.c_str();
+    } catch (...) {
+      error = "OCC operation failed";
+    }
+    Py_END_ALLOW_THREADS
+    if (error != NULL) {
+      PyErr_SetString(PyExc_RuntimeError, error);
+      SWIG_fail;
+    }
+  }
+}
+%enddef
+
+RELEASE_GIL(ConnectEdgesToWiresFixed)
+RELEASE_GIL(SectionsToFaces)
+RELEASE_GIL(SectionShapesToFaces)
+
 %include "Fixes.hxx"
\ No newline at end of file
@@ -1,8 +1,11 @@
 import OCC
+from OCC.Core.BRep import BRep_Builder
 from OCC.Core.BRepBuilderAPI import BRepBuilderAPI_MakeEdge, BRepBuilderAPI_MakeFace
 from OCC.Core.gp import gp_Pnt
+from OCC.Core.TopoDS import TopoDS_Compound
 from OCC.Core.TopTools import TopTools_HSequenceOfShape
 from OCC.Display.SimpleGui import init_display
+from OCC.Extend.TopologyUtils import TopologyExplorer
 
 import fixes
 
@@ -42,6 +45,7 @@ for e in edges:
 print(f"Before: {len(edge_shapes)}")
 wire_shapes = fixes.ConnectEdgesToWiresFixed(edge_shapes, 1e-3, False)
 print(f"After: {len(wire_shapes)}")
+assert len(wire_shapes) == 2
 
 wires = []
 for i in range(wire_shapes.Size()):
@@ -51,6 +55,32 @@ faces = []
 for w in wires:
     faces.append(BRepBuilderAPI_MakeFace(w).Face())
 
+# a square with a square hole and the rectangle, the hole is nested in the square's face
+points3 = [
+    gp_Pnt(0.25, 0.25, 0),
+    gp_Pnt(0.75, 0.25, 0),
+    gp_Pnt(0.75, 0.75, 0),
+    gp_Pnt(0.25, 0.75, 0),
+]
+for i in range(len(points3)):
+    edge = BRepBuilderAPI_MakeEdge(points3[i], points3[(i + 1) % len(points3)]).Edge()
+    edges.append(edge)
+
+section = TopoDS_Compound()
+builder = BRep_Builder()
+builder.MakeCompound(section)
+for e in edges:
+    builder.Add(section, e)
+
+section_shapes = TopTools_HSequenceOfShape()
+section_shapes.Append(section)
+face_compounds = fixes.SectionsToFaces(section_shapes, 1e-3, False)
+assert face_compounds.Size() == 1
+section_faces = list(TopologyExplorer(face_compounds.Value(1)).faces())
+wire_counts = sorted((TopologyExplorer(f).number_of_wires() for f in section_faces), reverse=True)
+assert len(section_faces) == 2
+assert wire_counts == [2, 1], wire_counts
+
 # for e in edges:
 #     display.DisplayColoredShape(e, "BLUE", update=True)
 for w in wires:
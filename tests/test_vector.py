@@ -0,0 +1,60 @@
+import io
+import re
+
+import numpy as np
+import pytest
+
+from batchplan.vector import PDFWriter, SVGWriter
+
+SQUARE = np.array([(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)])
+# the color all_black, the default color function, returns
+ALL_BLACK = (0, 0, 0, 0)
+
+
+def write_svg(color):
+    f = io.StringIO()
+    writer = SVGWriter(f, (0.0, 0.0, 1.0, 1.0))
+    writer.write_path([SQUARE], color, "0123456789abcdefghijkl")
+    writer.close()
+    return f.getvalue()
+
+
+def write_pdf(color):
+    f = io.BytesIO()
+    writer = PDFWriter(f, (0.0, 0.0, 1.0, 1.0))
+    writer.write_path([SQUARE], color, "0123456789abcdefghijkl")
+    writer.close()
+    return f.getvalue().decode("latin-1")
+
+
+def test_svg_fills_alpha_zero_opaque():
+    svg = write_svg(ALL_BLACK)
+    assert 'fill="#000000"' in svg
+    assert "opacity" not in svg
+
+
+def test_pdf_fills_alpha_zero_opaque():
+    pdf = write_pdf(ALL_BLACK)
+    assert "0.000 0.000 0.000 rg" in pdf
+    assert "f*" in pdf
+    assert "/ca" not in pdf and " gs" not in pdf
+
+
+def test_pdf_xref_offsets():
+    pdf = write_pdf((1, 0, 0, 1))
+    xref = int(re.search(r"startxref\n(\d+)", pdf).group(1))
+    assert pdf[xref:].startswith("xref")
+    offsets = [int(line[:10]) for line in pdf[xref:].splitlines()[3:9]]
+    for number, offset in enumerate(offsets, start=1):
+        assert pdf[offset:].startswith(f"{number} 0 obj")
+
+
+def test_default_color_fn_is_visible():
+    # stylings imports the OCC based utils
+    pytest.importorskip("OCC")
+    from batchplan.stylings import all_black
+
+    color, found = all_black()(None, None)
+    assert found
+    assert 'fill="#000000"' in write_svg(color)
+    assert "opacity" not in write_svg(color)